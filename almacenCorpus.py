@@ -0,0 +1,183 @@
+"""
+almacenCorpus.py
+Author: Sergio Salesa y Rubén Martín
+Last update: 2024-12-10
+
+Almacén columnar con los campos Dublin Core de los registros OAI-DC de Zaguan, para que los indexadores
+y el clasificador no tengan que volver a parsear los XML en cada ejecución.
+Cada campo se guarda en dos ficheros: <campo>.bin con los textos en UTF-8 uno detrás de otro y
+<campo>.offsets.npy con la posición de inicio de cada registro. Los ficheros se abren con memmap,
+así que leer un registro no obliga a cargar el almacén entero en memoria.
+Usage: python almacenCorpus.py -docs <docs folder> -store <store folder> [-procesos N]
+"""
+
+import os
+import sys
+import json
+import shutil
+import numpy as np
+import xml.etree.ElementTree as ET
+from concurrent.futures import ProcessPoolExecutor
+
+DC = '{http://purl.org/dc/elements/1.1/}'
+CAMPOS_DC = ['identifier', 'type', 'creator', 'contributor', 'publisher', 'title', 'description', 'subject', 'date']
+# Separa los valores de un campo repetido (varios dc:subject, por ejemplo). No puede aparecer en un XML válido.
+SEPARADOR_VALORES = '\x1f'
+VERSION_ALMACEN = 1
+
+
+# Extrae los campos Dublin Core de un registro. Cada campo es la lista de textos de sus elementos,
+# con '' para los elementos vacíos, en el mismo orden en que aparecen en el XML.
+def extraeRegistroDC(ruta):
+    campos = {campo: [] for campo in CAMPOS_DC}
+    for _, elem in ET.iterparse(ruta):
+        if elem.tag.startswith(DC):
+            campo = elem.tag[len(DC):]
+            if campo in campos:
+                campos[campo].append(elem.text or '')
+        elem.clear()
+    return campos
+
+
+# Acceso de solo lectura a un almacén creado con ingiereCorpus. Los registros están ordenados por ruta.
+class AlmacenCorpus:
+    def __init__(self, directorio):
+        self.directorio = directorio
+        with open(os.path.join(directorio, 'meta.json'), 'r', encoding='utf-8') as f:
+            self.meta = json.load(f)
+        self.mtimes = np.load(os.path.join(directorio, 'mtime.npy'), mmap_mode='r')
+        self.columnas = {campo: self.__abreColumna(campo) for campo in ['path'] + CAMPOS_DC}
+
+    def __abreColumna(self, campo):
+        offsets = np.load(os.path.join(self.directorio, campo + '.offsets.npy'), mmap_mode='r')
+        fichero = os.path.join(self.directorio, campo + '.bin')
+        if os.path.getsize(fichero) == 0:
+            return offsets, np.zeros(0, dtype=np.uint8)
+        return offsets, np.memmap(fichero, dtype=np.uint8, mode='r')
+
+    def __len__(self):
+        return self.meta['numRegistros']
+
+    def __texto(self, campo, i):
+        offsets, datos = self.columnas[campo]
+        return bytes(datos[offsets[i]:offsets[i + 1]]).decode('utf-8')
+
+    def ruta(self, i):
+        return self.__texto('path', i)
+
+    def mtime(self, i):
+        return float(self.mtimes[i])
+
+    # Devuelve la lista de valores de un campo Dublin Core del registro i
+    def valores(self, campo, i):
+        texto = self.__texto(campo, i)
+        return texto.split(SEPARADOR_VALORES) if texto else []
+
+    # Devuelve el registro i como un diccionario con la ruta, el mtime y la lista de valores de cada campo
+    def registro(self, i):
+        registro = {campo: self.valores(campo, i) for campo in CAMPOS_DC}
+        registro['path'] = self.ruta(i)
+        registro['mtime'] = self.mtime(i)
+        return registro
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.registro(i)
+
+
+# Escribe las columnas de un almacén nuevo a medida que se le añaden registros
+class __EscritorAlmacen:
+    def __init__(self, directorio):
+        self.directorio = directorio
+        os.makedirs(directorio)
+        self.ficheros = {campo: open(os.path.join(directorio, campo + '.bin'), 'wb') for campo in ['path'] + CAMPOS_DC}
+        self.offsets = {campo: [0] for campo in self.ficheros}
+        self.mtimes = []
+
+    def escribe(self, ruta, mtime, campos):
+        textos = dict(campos, path=ruta)
+        for campo, f in self.ficheros.items():
+            valor = textos[campo] if campo == 'path' else SEPARADOR_VALORES.join(textos[campo])
+            datos = valor.encode('utf-8')
+            f.write(datos)
+            self.offsets[campo].append(self.offsets[campo][-1] + len(datos))
+        self.mtimes.append(mtime)
+
+    def cierra(self):
+        for campo, f in self.ficheros.items():
+            f.close()
+            np.save(os.path.join(self.directorio, campo + '.offsets.npy'), np.array(self.offsets[campo], dtype=np.int64))
+        np.save(os.path.join(self.directorio, 'mtime.npy'), np.array(self.mtimes, dtype=np.float64))
+        with open(os.path.join(self.directorio, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump({'version': VERSION_ALMACEN, 'campos': CAMPOS_DC, 'numRegistros': len(self.mtimes)}, f)
+
+
+# Crea o actualiza el almacén con los XML de docs_folder. Solo se parsean los registros nuevos o cuyo
+# mtime ha cambiado; el resto se copian del almacén anterior. El almacén nuevo se escribe aparte y
+# sustituye al anterior al final, de modo que una ingesta interrumpida no lo deja a medias.
+def ingiereCorpus(docs_folder, directorio, procesos=None):
+    temporal = directorio.rstrip('/') + '.tmp'
+    viejo = directorio.rstrip('/') + '.old'
+    # Si una ingesta anterior se interrumpió tras apartar el almacén, se recupera antes de leerlo
+    if os.path.exists(viejo):
+        if os.path.exists(directorio):
+            shutil.rmtree(viejo)
+        else:
+            os.replace(viejo, directorio)
+
+    anterior = None
+    if os.path.isfile(os.path.join(directorio, 'meta.json')):
+        anterior = AlmacenCorpus(directorio)
+        if anterior.meta.get('version') != VERSION_ALMACEN:
+            anterior = None
+    previos = {anterior.ruta(i): i for i in range(len(anterior))} if anterior is not None else {}
+
+    ficheros = sorted(file for file in os.listdir(docs_folder) if file.endswith('.xml'))
+    mtimes = [os.path.getmtime(os.path.join(docs_folder, file)) for file in ficheros]
+    aParsear = [file for file, mtime in zip(ficheros, mtimes)
+                if file not in previos or anterior.mtime(previos[file]) != mtime]
+
+    if os.path.exists(temporal):
+        shutil.rmtree(temporal)
+    escritor = __EscritorAlmacen(temporal)
+    with ProcessPoolExecutor(max_workers=procesos) as pool:
+        parseados = pool.map(extraeRegistroDC, [os.path.join(docs_folder, file) for file in aParsear], chunksize=64)
+        pendientes = set(aParsear)
+        for file, mtime in zip(ficheros, mtimes):
+            if file in pendientes:
+                campos = next(parseados)
+            else:
+                campos = {campo: anterior.valores(campo, previos[file]) for campo in CAMPOS_DC}
+            escritor.escribe(file, mtime, campos)
+    escritor.cierra()
+
+    # Se aparta el almacén anterior en vez de borrarlo, para que siempre haya uno completo en disco: si el
+    # proceso muere entre los dos renombrados, la siguiente ingesta recupera el apartado
+    if os.path.exists(directorio):
+        os.replace(directorio, viejo)
+    os.replace(temporal, directorio)
+    if os.path.exists(viejo):
+        shutil.rmtree(viejo)
+    eliminados = len(set(previos) - set(ficheros))
+    print("Almacén actualizado: %d registros parseados, %d reutilizados, %d eliminados" % (
+        len(aParsear), len(ficheros) - len(aParsear), eliminados))
+
+
+if __name__ == '__main__':
+    docs_folder = '../docs'
+    store_folder = 'almacen'
+    procesos = None
+    i = 1
+    while i < len(sys.argv):
+        if sys.argv[i] == '-docs':
+            docs_folder = sys.argv[i + 1]
+            i = i + 1
+        elif sys.argv[i] == '-store':
+            store_folder = sys.argv[i + 1]
+            i = i + 1
+        elif sys.argv[i] == '-procesos':
+            procesos = int(sys.argv[i + 1])
+            i = i + 1
+        i = i + 1
+
+    ingiereCorpus(docs_folder, store_folder, procesos)
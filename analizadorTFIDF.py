@@ -0,0 +1,30 @@
+"""
+analizadorTFIDF.py
+Author: Sergio Salesa y Rubén Martín
+Last update: 2024-12-10
+
+Analizador de texto del clasificador TF-IDF de clasificadorTexto.py. Está en su propio módulo porque el
+vectorizador guardado con pickle lo referencia por nombre: si estuviera en clasificadorTexto.py y este se
+ejecutara como programa, el modelo quedaría ligado a __main__ y no se podría cargar desde otro script.
+"""
+
+import os
+import importlib.util
+from functools import lru_cache
+
+
+# Carga el analizador de los índices de practica2: tokenizador, minúsculas, stopwords en español
+# y el filtro Stemming de Snowball. Se importa el módulo por ruta porque no forma parte de un paquete.
+@lru_cache(maxsize=None)
+def __analizadorIndice():
+    ruta = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'practica2', 'index.py')
+    spec = importlib.util.spec_from_file_location('indicePractica2', ruta)
+    indice = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(indice)
+    return (indice.RegexTokenizer(expression=r"\w+") | indice.LowercaseFilter()
+            | indice.StopFilter(indice.spanish_stopwords) | indice.Stemming())
+
+# Convierte un texto en los términos del índice (unigramas y bigramas de raíces) para el vectorizador TF-IDF
+def analizaTextoTFIDF(texto):
+    terminos = [token.text for token in __analizadorIndice()(texto)]
+    return terminos + [a + ' ' + b for a, b in zip(terminos, terminos[1:])]
@@ -1,14 +1,25 @@
-import pandas as pd, re, numpy as np, os, unicodedata, sys
+import pandas as pd, re, numpy as np, os, unicodedata, sys, hashlib, time, json, pickle, subprocess, tempfile, resource
+import xml.etree.ElementTree as ET
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
 
 os.environ['TF_CPP_MIN_LOG_LEVEL'] = '2'
-from keras.preprocessing.text import Tokenizer
+from almacenCorpus import AlmacenCorpus
+from analizadorTFIDF import analizaTextoTFIDF
+from keras.preprocessing.text import Tokenizer, tokenizer_from_json
 from keras.layers import Dense, Embedding, LSTM
 from keras.optimizers import Adam
 from keras.models import Sequential, load_model
 from keras_nlp.layers import TransformerEncoder, TokenAndPositionEmbedding
 from keras.layers import Dense, GlobalAveragePooling1D
 from keras.utils import to_categorical, pad_sequences, set_random_seed
+from keras.callbacks import Callback
+import tensorflow as tf
 import matplotlib.pyplot as plt
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.pipeline import make_pipeline
+from sklearn.svm import LinearSVC
 
 
 namespaces = {
@@ -16,17 +27,52 @@ namespaces = {
     "dc": "http://purl.org/dc/elements/1.1/"
 }
 xpath = "/oai_dc:dc"
+DC = '{' + namespaces['dc'] + '}'
+camposClasificador = ['type', 'identifier', 'title', 'description', 'subject']
+cabeceraCSV = 'indice_categoria\t;titulo\t;descripcion\n'
+# Proporción de registros que se destinan al conjunto de test
+PROPORCION_TEST = 0.15
+patronNoAlfanumerico = re.compile(r'[^a-zA-Z0-9\s\n\t\r]')
+patronEspacios = re.compile(' +')
+# A partir de este número de documentos la limpieza se reparte entre varios procesos
+UMBRAL_LIMPIEZA_PARALELA = 20000
+TAM_BLOQUE_LIMPIEZA = 5000
+# Se incrementa cuando cambia el preprocesado para invalidar los corpus guardados en caché
+VERSION_CACHE_CORPUS = 1
+# Longitud máxima de las secuencias de tokens que se pasan a las redes
+MAXLEN_SECUENCIA = 300
+# Límites de longitud de los buckets del pipeline en streaming y tamaño del buffer de mezcla
+LIMITES_BUCKETS = [16, 32, 64, 128, 256]
+TAM_BUFFER_MEZCLA = 10000
+TAM_BLOQUE_LECTURA = 10000
+# Número de textos que se pasan a la vez a model.predict en la clasificación por lotes
+TAM_LOTE_CLASIFICACION = 4096
+tiposModelo = ['Transformer', 'LSTM', 'Densa', 'TFIDF']
+
+# Tabla de traducción que elimina las marcas diacríticas (categoría Mn) tras la normalización NFD.
+# Se calcula una única vez y permite quitar los acentos con str.translate en lugar de recorrer cada carácter.
+@lru_cache(maxsize=None)
+def __tablaMarcasDiacriticas():
+    return {c: None for c in range(sys.maxunicode + 1) if unicodedata.category(chr(c)) == 'Mn'}
 
 # Procesa una cadena de texto para eliminar simbolos de puntuación y otros caracteres no alfanumericos y acentos.
 # Convierte el texto a minuscula y elimina espacios extra.
-def __limpiaCadenasDeTexto(docs):
-  norm_docs = []
-  for doc in docs:
-    doc = ''.join(c for c in unicodedata.normalize('NFD', doc) if unicodedata.category(c) != 'Mn')
-    doc = re.sub(r'[^a-zA-Z0-9\s\n\t\r]', ' ', doc).lower()
-    doc = re.sub(' +', ' ', doc).strip()
-    norm_docs.append(doc)
-  return norm_docs
+def __limpiaCadena(doc):
+    doc = unicodedata.normalize('NFD', doc).translate(__tablaMarcasDiacriticas())
+    doc = patronNoAlfanumerico.sub(' ', doc).lower()
+    return patronEspacios.sub(' ', doc).strip()
+
+def __limpiaBloque(docs):
+    return [__limpiaCadena(doc) for doc in docs]
+
+# Limpia una lista de documentos. Las entradas grandes se reparten en bloques entre varios procesos.
+def __limpiaCadenasDeTexto(docs, procesos=None):
+  docs = list(docs)
+  if len(docs) < UMBRAL_LIMPIEZA_PARALELA:
+    return __limpiaBloque(docs)
+  bloques = [docs[i:i + TAM_BLOQUE_LIMPIEZA] for i in range(0, len(docs), TAM_BLOQUE_LIMPIEZA)]
+  with ProcessPoolExecutor(max_workers=procesos) as pool:
+    return [doc for bloque in pool.map(__limpiaBloque, bloques) for doc in bloque]
 
 # tokeniza el texto y lo conviete en vectores de longitud constante aññadiendo tokens comodin para frases cortas
 # el código describe como ajustar el tamaño de los vectores generados a la cadena mas larga.
@@ -35,11 +81,10 @@ def __tokenizadorTexto(X_train, X_test):
     t.fit_on_texts(X_train)
     t.word_index['<PAD>'] = 0
     num_columns = int(np.max([len(row) for row in X_train]) + np.max([len(row) for row in X_test]))
-    maxlen = 300
-    max_num_columns = min(num_columns,maxlen)
+    max_num_columns = min(num_columns,MAXLEN_SECUENCIA)
     X_entrenT = pad_sequences(t.texts_to_sequences(X_train), maxlen=max_num_columns, padding='post')
     X_testT = pad_sequences(t.texts_to_sequences(X_test), maxlen=max_num_columns, padding='post')
-    return X_entrenT, X_testT, len(t.word_index)
+    return X_entrenT, X_testT, t
 
 #Método para guardar una serie de datos con las etiquetas indicadas en los ejes
 def visualizaSerieDatos(datos,etiquetaX, etiquetaY, fichero):
@@ -54,17 +99,55 @@ def visualizaSerieDatos(datos,etiquetaX, etiquetaY, fichero):
 def NormalizeData(data):
     return (data - np.min(data)) / (np.max(data) - np.min(data))
 
+# Normaliza con un rango [mínimo, máximo] fijo, el del conjunto de entrenamiento, para que test e
+# inferencia usen la misma transformación con la que se entrenó el modelo
+def NormalizeDataRango(data, normalizacion):
+    minimo, maximo = normalizacion
+    return (data - minimo) / (maximo - minimo)
+
+# Calcula la clave de la caché del corpus a partir del contenido de los CSV de entrada
+def __claveCacheCorpus(ficheros):
+    h = hashlib.sha1(('v%d' % VERSION_CACHE_CORPUS).encode('utf-8'))
+    for fichero in ficheros:
+        with open(fichero, 'rb') as f:
+            for bloque in iter(lambda: f.read(1 << 20), b''):
+                h.update(bloque)
+    return h.hexdigest()
+
 # devuelve los datos de entrenamiento y test del clasificador
 # lee los datos, los limpia, y tokeniza. Las categorias las convierte a one-hot.
+# El corpus tokenizado y el vocabulario del Tokenizer se guardan en dir/cache con una clave que depende
+# del contenido de los CSV, de modo que si no cambian las siguientes ejecuciones no repiten el preprocesado.
 def lecturaDatosEntrenamientoYTestClasificador(dir, numCategorias):
-    dataset_entrenamiento = __leeDataFrameClasificador(dir + '/clasificacionZaguanEntrenamiento.csv')
-    dataset_test = __leeDataFrameClasificador(dir + '/clasificacionZaguanTest.csv')
-    X_entren = __limpiaCadenasDeTexto(dataset_entrenamiento['Text'].values)
-    X_test = __limpiaCadenasDeTexto(dataset_test['Text'].values)
-    X_entren, X_test, tamVoc = __tokenizadorTexto(X_entren, X_test)
-    y_entren = to_categorical(dataset_entrenamiento['indice_categoria'].values -1 , num_classes=numCategorias)
-    y_test = to_categorical(dataset_test['indice_categoria'].values -1 , num_classes=numCategorias )
-    return (X_entren, y_entren, X_test, y_test, tamVoc)
+    ficheroEntrenamiento = dir + '/clasificacionZaguanEntrenamiento.csv'
+    ficheroTest = dir + '/clasificacionZaguanTest.csv'
+    clave = __claveCacheCorpus([ficheroEntrenamiento, ficheroTest])
+    ficheroCorpus = dir + '/cache/corpus_' + clave + '.npz'
+    ficheroVocabulario = dir + '/cache/vocabulario_' + clave + '.json'
+
+    if os.path.isfile(ficheroCorpus) and os.path.isfile(ficheroVocabulario):
+        corpus = np.load(ficheroCorpus)
+        X_entren, X_test = corpus['X_entren'], corpus['X_test']
+        categorias_entren, categorias_test = corpus['categorias_entren'], corpus['categorias_test']
+        with open(ficheroVocabulario, 'r', encoding='utf-8') as f:
+            tokenizer = tokenizer_from_json(f.read())
+    else:
+        dataset_entrenamiento = __leeDataFrameClasificador(ficheroEntrenamiento)
+        dataset_test = __leeDataFrameClasificador(ficheroTest)
+        X_entren = __limpiaCadenasDeTexto(dataset_entrenamiento['Text'].values)
+        X_test = __limpiaCadenasDeTexto(dataset_test['Text'].values)
+        X_entren, X_test, tokenizer = __tokenizadorTexto(X_entren, X_test)
+        categorias_entren = dataset_entrenamiento['indice_categoria'].values
+        categorias_test = dataset_test['indice_categoria'].values
+        os.makedirs(dir + '/cache', exist_ok=True)
+        np.savez(ficheroCorpus, X_entren=X_entren, X_test=X_test,
+                 categorias_entren=categorias_entren, categorias_test=categorias_test)
+        with open(ficheroVocabulario, 'w', encoding='utf-8') as f:
+            f.write(tokenizer.to_json())
+
+    y_entren = to_categorical(categorias_entren -1 , num_classes=numCategorias)
+    y_test = to_categorical(categorias_test -1 , num_classes=numCategorias )
+    return (X_entren, y_entren, X_test, y_test, len(tokenizer.word_index), tokenizer)
 
 # Método para leer los ficheros tabulares del ejercicio de clasificación de texto (clasificación, título y descripción)
 # Lee un fichero en un dataframe de Pandas y junta el título con la descripción
@@ -74,47 +157,533 @@ def __leeDataFrameClasificador(file):
     df.drop(['titulo', 'descripcion'], axis=1, inplace=True)
     return df
 
-def procesarXML(docs_folder):
-    fEntrenamiento = open('datos/clasificacionZaguanEntrenamiento.csv', 'w', encoding='utf-8')
-    fEntrenamiento.write('indice_categoria\t;titulo\t;descripcion\n')
-    fTest = open('datos/clasificacionZaguanTest.csv', 'w', encoding='utf-8')
-    fTest.write('indice_categoria\t;titulo\t;descripcion\n')
-
-    if (os.path.exists(docs_folder)):
-            for file in sorted(os.listdir(docs_folder)):
-                if file.endswith('.xml'):
-                    df = pd.read_xml(docs_folder + '/' + file, xpath=xpath, namespaces=namespaces)
-                    tipo = df['type'].iloc[0]
-                    if tipo == "TAZ-TFG":
-                        # Extraemos el título y descripción
-                        titulo = df['title'].iloc[0] if 'title' in df else ''
-                        descripcion = df['description'].iloc[0] if 'description' in df else ''
-                        
-                        # Extraemos las categorías
-                        cadenas_categoria = df['subject'].dropna().tolist()
-
-                        if len(cadenas_categoria) > 0:
-                            cadenas_categoria = __limpiaCadenasDeTexto(cadenas_categoria)
-                        else:
-                            cadenas_categoria = ['']  
-                            
-                        # Buscar el índice de carrera
-                        indice_carrera = -1
-                        for i in range(len(string_categorias)):
-                            for categoria in cadenas_categoria:
-                                if any(carrera in categoria for carrera in nombre_carreras_categorias[i]):
-                                    indice_carrera = i + 1
-                                    break
-
-                        # Si no se encuentra ninguna coincidencia, asignar un índice por defecto
-                        if indice_carrera == -1:
-                            indice_carrera = len(string_categorias)
-
-                        # Aleatorización para decidir el archivo de salida
-                        if np.random.rand() <= 0.15:
-                            fTest.write(str(indice_carrera) + '\t;' + titulo + '\t;' + descripcion + '\n')
-                        else:
-                            fEntrenamiento.write(str(indice_carrera) + '\t;' + titulo + '\t;' + descripcion + '\n')
+# Lee un fichero tabular del clasificador por bloques de filas, para no cargarlo entero en memoria
+def __leeBloquesClasificador(file, tamBloque=TAM_BLOQUE_LECTURA):
+    for df in pd.read_csv(file, sep='\t;', index_col=False, engine='python', chunksize=tamBloque):
+        df['Text'] = df['titulo'] + '. ' + df['descripcion']
+        yield df
+
+# Escribe las secuencias de tokens (sin padding, recortadas a MAXLEN_SECUENCIA) y su categoría en un TFRecord
+def __escribeSecuenciasTFRecord(file, tokenizer, ficheroSalida):
+    numDocs = 0
+    with tf.io.TFRecordWriter(ficheroSalida) as writer:
+        for df in __leeBloquesClasificador(file):
+            secuencias = tokenizer.texts_to_sequences(__limpiaCadenasDeTexto(df['Text'].values))
+            for secuencia, categoria in zip(secuencias, df['indice_categoria'].values):
+                ejemplo = tf.train.Example(features=tf.train.Features(feature={
+                    'tokens': tf.train.Feature(int64_list=tf.train.Int64List(value=secuencia[-MAXLEN_SECUENCIA:] or [0])),
+                    'categoria': tf.train.Feature(int64_list=tf.train.Int64List(value=[int(categoria)]))
+                }))
+                writer.write(ejemplo.SerializeToString())
+                numDocs += 1
+    return numDocs
+
+# Prepara el corpus para el entrenamiento en streaming: ajusta el Tokenizer leyendo el CSV de entrenamiento
+# por bloques y guarda las secuencias de entrenamiento y test en TFRecord dentro de dir/cache.
+# Como en lecturaDatosEntrenamientoYTestClasificador, si los CSV no han cambiado se reutiliza lo ya generado.
+def preparaCorpusStreaming(dir):
+    ficheroEntrenamiento = dir + '/clasificacionZaguanEntrenamiento.csv'
+    ficheroTest = dir + '/clasificacionZaguanTest.csv'
+    clave = __claveCacheCorpus([ficheroEntrenamiento, ficheroTest])
+    tfrecordEntrenamiento = dir + '/cache/secuencias_entrenamiento_' + clave + '.tfrecord'
+    tfrecordTest = dir + '/cache/secuencias_test_' + clave + '.tfrecord'
+    ficheroVocabulario = dir + '/cache/vocabulario_streaming_' + clave + '.json'
+
+    if os.path.isfile(tfrecordEntrenamiento) and os.path.isfile(tfrecordTest) and os.path.isfile(ficheroVocabulario):
+        with open(ficheroVocabulario, 'r', encoding='utf-8') as f:
+            tokenizer = tokenizer_from_json(f.read())
+    else:
+        tokenizer = Tokenizer(oov_token='<UNK>')
+        for df in __leeBloquesClasificador(ficheroEntrenamiento):
+            tokenizer.fit_on_texts(__limpiaCadenasDeTexto(df['Text'].values))
+        tokenizer.word_index['<PAD>'] = 0
+        os.makedirs(dir + '/cache', exist_ok=True)
+        __escribeSecuenciasTFRecord(ficheroEntrenamiento, tokenizer, tfrecordEntrenamiento)
+        __escribeSecuenciasTFRecord(ficheroTest, tokenizer, tfrecordTest)
+        with open(ficheroVocabulario, 'w', encoding='utf-8') as f:
+            f.write(tokenizer.to_json())
+    return tfrecordEntrenamiento, tfrecordTest, len(tokenizer.word_index), tokenizer
+
+def __parseaSecuencia(ejemplo):
+    campos = tf.io.parse_single_example(ejemplo, {
+        'tokens': tf.io.VarLenFeature(tf.int64),
+        'categoria': tf.io.FixedLenFeature([], tf.int64)
+    })
+    return tf.cast(tf.sparse.to_dense(campos['tokens']), tf.int32), campos['categoria']
+
+# Crea un tf.data.Dataset que lee en streaming un TFRecord generado por preparaCorpusStreaming.
+# Las secuencias se agrupan en buckets por longitud y cada lote solo se rellena con <PAD> hasta
+# la secuencia más larga de su bucket, en lugar de hasta MAXLEN_SECUENCIA.
+def creaDatasetStreaming(fichero, numCategorias, batchSize, entrenamiento=True):
+    ds = tf.data.TFRecordDataset(fichero)
+    ds = ds.map(__parseaSecuencia, num_parallel_calls=tf.data.AUTOTUNE)
+    if entrenamiento:
+        ds = ds.shuffle(TAM_BUFFER_MEZCLA)
+    ds = ds.map(lambda tokens, categoria: (tokens, tf.one_hot(categoria - 1, numCategorias)),
+                num_parallel_calls=tf.data.AUTOTUNE)
+    ds = ds.bucket_by_sequence_length(
+        element_length_func=lambda tokens, categoria: tf.shape(tokens)[0],
+        bucket_boundaries=LIMITES_BUCKETS,
+        bucket_batch_sizes=[batchSize] * (len(LIMITES_BUCKETS) + 1))
+    return ds.prefetch(tf.data.AUTOTUNE)
+
+# Devuelve las categorías predichas y reales de un dataset, recorriéndolo una sola vez por lotes
+def prediceDataset(model, ds):
+    y_pred = []
+    y_real = []
+    for tokens, categorias in ds:
+        y_pred.append(np.argmax(model.predict_on_batch(tokens), axis=1))
+        y_real.append(np.argmax(categorias.numpy(), axis=1))
+    return np.concatenate(y_pred), np.concatenate(y_real)
+
+# Callback que registra el tiempo de cada epoch del entrenamiento
+class TiempoEpoch(Callback):
+    def on_train_begin(self, logs=None):
+        self.tiempos = []
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self.inicio = time.perf_counter()
+
+    def on_epoch_end(self, epoch, logs=None):
+        self.tiempos.append(time.perf_counter() - self.inicio)
+
+# Compara el tiempo por epoch del LSTM y el Transformer entrenando con padding fijo frente al pipeline
+# en streaming con buckets. Se entrenan 2 epochs y se toma la segunda para no contar la compilación del grafo.
+def comparaTiempoEpoch(dir, numCategorias, tamEmbd, batchSize, resultsDir):
+    X_entren, y_entren, _, _, tamVoc, _ = lecturaDatosEntrenamientoYTestClasificador(dir, numCategorias)
+    tfrecordEntrenamiento, _, tamVocStreaming, _ = preparaCorpusStreaming(dir)
+    dsEntren = creaDatasetStreaming(tfrecordEntrenamiento, numCategorias, batchSize)
+    os.makedirs(resultsDir, exist_ok=True)
+    with open(resultsDir + '/tiempos_epoch.txt', 'w') as f:
+        f.write('modelo\tpadding_fijo\tbuckets\taceleracion\n')
+        for modelo in ['LSTM', 'Transformer']:
+            tiemposFijo = TiempoEpoch()
+            tiemposBuckets = TiempoEpoch()
+            if modelo == 'LSTM':
+                model = createModelLSTM(tamVoc, len(X_entren[0]), tamEmbd, numCategorias)
+                modelStreaming = createModelLSTM(tamVocStreaming, None, tamEmbd, numCategorias)
+            else:
+                model = createModelTransformer(tamVoc, len(X_entren[0]), tamEmbd, numCategorias)
+                modelStreaming = createModelTransformer(tamVocStreaming, MAXLEN_SECUENCIA, tamEmbd, numCategorias)
+            model.fit(X_entren, y_entren, epochs=2, batch_size=batchSize, verbose=0, callbacks=[tiemposFijo])
+            modelStreaming.fit(dsEntren, epochs=2, verbose=0, callbacks=[tiemposBuckets])
+            fijo, buckets = tiemposFijo.tiempos[-1], tiemposBuckets.tiempos[-1]
+            print("%s: %.2f s/epoch con padding fijo, %.2f s/epoch con buckets (%.2fx)" % (modelo, fijo, buckets, fijo / buckets))
+            f.write('%s\t%.3f\t%.3f\t%.2f\n' % (modelo, fijo, buckets, fijo / buckets))
+
+# Extrae de un registro OAI-DC los campos que necesita el clasificador (tipo, título, descripción y materias).
+# Se recorre el fichero en streaming con iterparse en lugar de construir un DataFrame por registro.
+def __extraeRegistro(fichero):
+    campos = {campo: [] for campo in camposClasificador}
+    for _, elem in ET.iterparse(fichero):
+        if elem.tag.startswith(DC):
+            campo = elem.tag[len(DC):]
+            if campo in campos and elem.text is not None:
+                campos[campo].append(elem.text)
+        elem.clear()
+    return campos
+
+# Decide de forma determinista si un registro va al conjunto de test a partir del hash de su nombre,
+# de modo que la partición es reproducible y no depende del orden en que se procesen los ficheros
+def __esRegistroTest(nombre):
+    valor = int.from_bytes(hashlib.md5(nombre.encode('utf-8')).digest()[:8], 'big')
+    return valor / 2**64 <= PROPORCION_TEST
+
+# Procesa un único registro XML y devuelve su nombre y la línea del CSV, o None si no es un TFG.
+# Se ejecuta en los procesos del pool, por lo que solo recibe y devuelve datos serializables.
+def __procesaRegistro(ruta):
+    return __lineaRegistro(os.path.basename(ruta), __extraeRegistro(ruta))
+
+# Construye la línea del CSV de un registro a partir de sus campos, o devuelve None si no es un TFG.
+# Un registro es un TFG si alguno de sus dc:type es TAZ-TFG. Si hay varios títulos o descripciones se usa
+# el primero (el resto suelen ser traducciones) y para la categoría se usan todas las materias; con
+# pd.read_xml los elementos repetidos se quedaban solo con el último.
+def __lineaRegistro(nombre, campos):
+    if "TAZ-TFG" not in campos['type']:
+        return None
+    # Extraemos el título y descripción
+    titulo = campos['title'][0] if campos['title'] else ''
+    descripcion = campos['description'][0] if campos['description'] else ''
+
+    # Extraemos las categorías
+    cadenas_categoria = campos['subject']
+    if len(cadenas_categoria) > 0:
+        cadenas_categoria = __limpiaCadenasDeTexto(cadenas_categoria)
+    else:
+        cadenas_categoria = ['']
+
+    indice_carrera = __indiceCarrera(cadenas_categoria)
+
+    return nombre, str(indice_carrera) + '\t;' + titulo + '\t;' + descripcion + '\n'
+
+# Compila las palabras clave de todas las carreras en una única expresión regular con alternativas.
+# Precedencia: si las materias encajan con varias categorías gana la de mayor índice en string_categorias,
+# que es lo que hacía el bucle anidado original al quedarse con la última coincidencia. Para mantenerla
+# en una sola pasada las alternativas se ordenan por categoría descendente (y por longitud dentro de cada
+# categoría) y se envuelven en un lookahead, de modo que se prueban en todas las posiciones del texto aunque
+# las palabras se solapen (p. ej. 'informacion' dentro de 'tecnologia de la informacion').
+def __compilaPatronCarreras(carreras):
+    categoriaPorPalabra = {}
+    alternativas = []
+    for i in reversed(range(len(carreras))):
+        for palabra in sorted(carreras[i], key=len, reverse=True):
+            if palabra not in categoriaPorPalabra:
+                categoriaPorPalabra[palabra] = i + 1
+                alternativas.append(re.escape(palabra))
+    return re.compile('(?=(' + '|'.join(alternativas) + '))'), categoriaPorPalabra
+
+# Devuelve el índice de carrera de un registro a partir de sus materias ya limpias.
+# Todas las materias se recorren en una única pasada del patrón compilado.
+def __indiceCarrera(cadenas_categoria):
+    indice_carrera = -1
+    for m in patronCarreras.finditer('\n'.join(cadenas_categoria)):
+        indice_carrera = max(indice_carrera, categoriaPorPalabra[m.group(1)])
+        if indice_carrera == len(string_categorias):
+            break
+    # Si no se encuentra ninguna coincidencia, asignar un índice por defecto
+    if indice_carrera == -1:
+        indice_carrera = len(string_categorias)
+    return indice_carrera
+
+# Versión original del etiquetado con bucles anidados, se conserva solo para compararla en benchmarkEtiquetado
+def __indiceCarreraBucle(cadenas_categoria):
+    indice_carrera = -1
+    for i in range(len(string_categorias)):
+        for categoria in cadenas_categoria:
+            if any(carrera in categoria for carrera in nombre_carreras_categorias[i]):
+                indice_carrera = i + 1
+                break
+    if indice_carrera == -1:
+        indice_carrera = len(string_categorias)
+    return indice_carrera
+
+# Compara el rendimiento del etiquetado con el patrón compilado frente al bucle anidado original.
+# La muestra se construye con las materias reales de los registros de docs_folder, repetidas hasta tamMuestra.
+def benchmarkEtiquetado(docs_folder, tamMuestra, procesos=None):
+    rutas = [os.path.join(docs_folder, file) for file in sorted(os.listdir(docs_folder)) if file.endswith('.xml')]
+    with ProcessPoolExecutor(max_workers=procesos) as pool:
+        materias = [__limpiaCadenasDeTexto(campos['subject']) or ['']
+                    for campos in pool.map(__extraeRegistro, rutas, chunksize=64)]
+    if not materias:
+        print("No hay registros en " + docs_folder)
+        return
+    muestra = (materias * (tamMuestra // len(materias) + 1))[:tamMuestra]
+
+    inicio = time.perf_counter()
+    etiquetasBucle = [__indiceCarreraBucle(cadenas) for cadenas in muestra]
+    tiempoBucle = time.perf_counter() - inicio
+    inicio = time.perf_counter()
+    etiquetasPatron = [__indiceCarrera(cadenas) for cadenas in muestra]
+    tiempoPatron = time.perf_counter() - inicio
+
+    diferencias = sum(1 for a, b in zip(etiquetasBucle, etiquetasPatron) if a != b)
+    print("Registros etiquetados: %d" % len(muestra))
+    print("Bucle anidado: %.3f s (%.0f registros/s)" % (tiempoBucle, len(muestra) / tiempoBucle))
+    print("Patrón compilado: %.3f s (%.0f registros/s)" % (tiempoPatron, len(muestra) / tiempoPatron))
+    print("Aceleración: %.1fx, etiquetas distintas: %d" % (tiempoBucle / tiempoPatron, diferencias))
+
+# Recorre los campos de los registros de un almacén creado con almacenCorpus.py, sin parsear ningún XML.
+# Los elementos vacíos se descartan, igual que hace __extraeRegistro.
+def __registrosAlmacen(almacen):
+    for i in range(len(almacen)):
+        yield almacen.ruta(i), {campo: [v for v in almacen.valores(campo, i) if v] for campo in camposClasificador}
+
+# Reparte las líneas de los registros procesados entre entrenamiento y test según el hash de su nombre
+def __repartePorConjunto(resultados, lineasEntrenamiento, lineasTest):
+    for resultado in resultados:
+        if resultado is None:
+            continue
+        nombre, linea = resultado
+        if __esRegistroTest(nombre):
+            lineasTest.append(linea)
+        else:
+            lineasEntrenamiento.append(linea)
+
+# Genera los CSV de entrenamiento y test a partir de los registros XML de Zaguan.
+# Los registros se procesan en paralelo y cada CSV se escribe de una vez al final.
+# Si se indica un almacén del corpus (almacenCorpus.py) los registros se leen de él en lugar de los XML.
+def procesarXML(docs_folder, procesos=None, almacen=None):
+    lineasEntrenamiento = []
+    lineasTest = []
+    if almacen is not None:
+        resultados = (__lineaRegistro(nombre, campos) for nombre, campos in __registrosAlmacen(AlmacenCorpus(almacen)))
+        __repartePorConjunto(resultados, lineasEntrenamiento, lineasTest)
+    elif (os.path.exists(docs_folder)):
+        rutas = [os.path.join(docs_folder, file) for file in sorted(os.listdir(docs_folder)) if file.endswith('.xml')]
+        with ProcessPoolExecutor(max_workers=procesos) as pool:
+            __repartePorConjunto(pool.map(__procesaRegistro, rutas, chunksize=64), lineasEntrenamiento, lineasTest)
+
+    os.makedirs('datos', exist_ok=True)
+    with open('datos/clasificacionZaguanEntrenamiento.csv', 'w', encoding='utf-8') as fEntrenamiento:
+        fEntrenamiento.write(cabeceraCSV)
+        fEntrenamiento.writelines(lineasEntrenamiento)
+    with open('datos/clasificacionZaguanTest.csv', 'w', encoding='utf-8') as fTest:
+        fTest.write(cabeceraCSV)
+        fTest.writelines(lineasTest)
+
+# Guarda un modelo entrenado en un directorio junto con lo necesario para clasificar textos nuevos:
+# el vocabulario del Tokenizer, la longitud de las secuencias, las categorías y, para el modelo denso,
+# el rango con el que se normalizaron los datos de entrenamiento.
+# El modelo TF-IDF incluye su propio vocabulario, así que se guarda entero con pickle y sin Tokenizer.
+def guardaModeloClasificador(directorio, modelo, model, tokenizer, maxlen, claveCorpus, streaming=False, normalizacion=None):
+    os.makedirs(directorio, exist_ok=True)
+    if modelo == 'TFIDF':
+        with open(directorio + '/modelo.pkl', 'wb') as f:
+            pickle.dump(model, f)
+    else:
+        model.save(directorio + '/modelo.keras')
+        with open(directorio + '/vocabulario.json', 'w', encoding='utf-8') as f:
+            f.write(tokenizer.to_json())
+    config = {
+        'modelo': modelo,
+        'maxlen': int(maxlen) if maxlen is not None else None,
+        'categorias': string_categorias,
+        'corpus': claveCorpus,
+        'streaming': streaming,
+        'normalizacion': normalizacion
+    }
+    with open(directorio + '/config.json', 'w', encoding='utf-8') as f:
+        json.dump(config, f, ensure_ascii=False, indent=2)
+
+# Los modelos TF-IDF guardados cuando el analizador estaba en este fichero lo referencian como
+# __main__.analizaTextoTFIDF; se redirigen al módulo analizadorTFIDF para poder cargarlos desde cualquier script
+class __UnpicklerTFIDF(pickle.Unpickler):
+    def find_class(self, module, name):
+        if module == '__main__' and name == 'analizaTextoTFIDF':
+            return analizaTextoTFIDF
+        return super().find_class(module, name)
+
+# Carga un modelo guardado con guardaModeloClasificador. Devuelve el modelo, el Tokenizer y la configuración.
+def cargaModeloClasificador(directorio):
+    with open(directorio + '/config.json', 'r', encoding='utf-8') as f:
+        config = json.load(f)
+    if config['modelo'] == 'TFIDF':
+        with open(directorio + '/modelo.pkl', 'rb') as f:
+            return __UnpicklerTFIDF(f).load(), None, config
+    with open(directorio + '/vocabulario.json', 'r', encoding='utf-8') as f:
+        tokenizer = tokenizer_from_json(f.read())
+    model = load_model(directorio + '/modelo.keras', custom_objects={
+        'TransformerEncoder': TransformerEncoder,
+        'TokenAndPositionEmbedding': TokenAndPositionEmbedding
+    })
+    return model, tokenizer, config
+
+# Indica si en el directorio hay un modelo guardado que se entrenó con el mismo corpus y modo de entrenamiento
+def existeModeloClasificador(directorio, claveCorpus, streaming):
+    if not os.path.isfile(directorio + '/config.json'):
+        return False
+    with open(directorio + '/config.json', 'r', encoding='utf-8') as f:
+        config = json.load(f)
+    return config.get('corpus') == claveCorpus and config.get('streaming') == streaming
+
+# Convierte textos sin limpiar en la entrada que espera un modelo guardado, con la misma limpieza,
+# tokenización y padding que se usaron en el entrenamiento
+def preparaEntradaModelo(textos, tokenizer, config):
+    secuencias = tokenizer.texts_to_sequences(__limpiaCadenasDeTexto(textos))
+    if config['streaming']:
+        # Los modelos entrenados con buckets aceptan cualquier longitud, basta con rellenar hasta la más larga del lote
+        longitud = min(max(1, max((len(s) for s in secuencias), default=1)), config['maxlen'])
+        X = pad_sequences(secuencias, maxlen=longitud, padding='post')
+    else:
+        X = pad_sequences(secuencias, maxlen=config['maxlen'], padding='post')
+    if config['normalizacion'] is not None:
+        X = NormalizeDataRango(X, config['normalizacion'])
+    return X
+
+# Devuelve el identificador y el texto a clasificar (título y descripción) de un registro XML
+def __textoRegistro(ruta):
+    campos = __extraeRegistro(ruta)
+    identificador = campos['identifier'][0] if campos['identifier'] else os.path.basename(ruta)
+    titulo = campos['title'][0] if campos['title'] else ''
+    descripcion = campos['description'][0] if campos['description'] else ''
+    return identificador, titulo + '. ' + descripcion
+
+# Recorre los textos a clasificar: registros XML de un directorio (en paralelo) o filas de un CSV con
+# el mismo formato que los de entrenamiento. Si el CSV no tiene columna identificador se usa el número de fila.
+def __textosAClasificar(entrada, procesos=None):
+    if os.path.isdir(entrada):
+        rutas = [os.path.join(entrada, file) for file in sorted(os.listdir(entrada)) if file.endswith('.xml')]
+        with ProcessPoolExecutor(max_workers=procesos) as pool:
+            yield from pool.map(__textoRegistro, rutas, chunksize=64)
+    else:
+        fila = 0
+        for df in __leeBloquesClasificador(entrada):
+            if 'identificador' in df:
+                identificadores = df['identificador'].astype(str).values
+            else:
+                identificadores = [str(fila + j + 1) for j in range(len(df))]
+            fila += len(df)
+            yield from zip(identificadores, df['Text'].fillna('').values)
+
+# Clasifica en lotes grandes los registros de entrada con un modelo guardado y escribe para cada uno
+# su identificador y la categoría predicha
+# Si se indica una cuantización se usa el modelo TFLite exportado con exportaTFLite en lugar del modelo Keras.
+def clasificaLote(directorioModelo, entrada, salida, tamLote=TAM_LOTE_CLASIFICACION, procesos=None, cuantizacion=None):
+    if cuantizacion is not None:
+        clasificador = ClasificadorTFLite(directorioModelo, cuantizacion)
+        model, tokenizer, config = clasificador, clasificador.tokenizer, clasificador.config
+    else:
+        model, tokenizer, config = cargaModeloClasificador(directorioModelo)
+    categorias = config['categorias']
+    textos = __textosAClasificar(entrada, procesos)
+    numRegistros = 0
+    inicio = time.perf_counter()
+    with open(salida, 'w', encoding='utf-8') as f:
+        while True:
+            lote = list(islice(textos, tamLote))
+            if not lote:
+                break
+            identificadores, contenidos = zip(*lote)
+            if config['modelo'] == 'TFIDF':
+                y_pred = model.predict(list(contenidos))
+            elif cuantizacion is not None:
+                y_pred = model.clasifica(contenidos)
+            else:
+                X = preparaEntradaModelo(contenidos, tokenizer, config)
+                y_pred = np.argmax(model.predict(X, batch_size=tamLote, verbose=0), axis=1)
+            f.writelines(identificador + '\t' + categorias[c] + '\n' for identificador, c in zip(identificadores, y_pred))
+            numRegistros += len(lote)
+    tiempo = time.perf_counter() - inicio
+    print("%d registros clasificados en %.2f s (%.0f registros/s). Resultados en %s" % (numRegistros, tiempo, numRegistros / tiempo if tiempo > 0 else 0, salida))
+
+# Convierte el modelo Keras de un directorio de modelo a TFLite cuantizado y lo guarda en el mismo directorio,
+# para reutilizar su vocabulario y configuración. Con 'int8' se cuantizan los pesos a enteros de 8 bits
+# (rango dinámico) y con 'float16' se guardan en media precisión.
+def exportaTFLite(directorioModelo, cuantizacion='int8'):
+    model, _, config = cargaModeloClasificador(directorioModelo)
+    if config['modelo'] == 'TFIDF':
+        raise ValueError("El modelo TFIDF no es un modelo Keras y no se puede exportar a TFLite")
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if cuantizacion == 'float16':
+        converter.target_spec.supported_types = [tf.float16]
+    elif cuantizacion != 'int8':
+        raise ValueError("Cuantización no válida: " + cuantizacion)
+    # El LSTM necesita operaciones de TensorFlow que no están entre las nativas de TFLite
+    converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS, tf.lite.OpsSet.SELECT_TF_OPS]
+    converter._experimental_lower_tensor_list_ops = False
+    contenido = converter.convert()
+    fichero = directorioModelo + '/modelo_' + cuantizacion + '.tflite'
+    with open(fichero, 'wb') as f:
+        f.write(contenido)
+    return fichero
+
+# Ejecuta un modelo TFLite exportado con exportaTFLite. Los textos se limpian, tokenizan y rellenan igual
+# que en el entrenamiento, con el vocabulario guardado junto al modelo.
+class ClasificadorTFLite:
+    def __init__(self, directorioModelo, cuantizacion='int8', hilos=None):
+        with open(directorioModelo + '/config.json', 'r', encoding='utf-8') as f:
+            self.config = json.load(f)
+        if self.config['modelo'] == 'TFIDF':
+            raise ValueError("El modelo TFIDF no es un modelo Keras y no tiene versión TFLite")
+        with open(directorioModelo + '/vocabulario.json', 'r', encoding='utf-8') as f:
+            self.tokenizer = tokenizer_from_json(f.read())
+        self.interprete = tf.lite.Interpreter(model_path=directorioModelo + '/modelo_' + cuantizacion + '.tflite', num_threads=hilos)
+        self.entrada = self.interprete.get_input_details()[0]
+        self.salida = self.interprete.get_output_details()[0]
+        self.forma = None
+
+    # Devuelve las probabilidades de cada categoría para una matriz de secuencias ya preparada
+    def predice(self, X):
+        if self.forma != X.shape:
+            self.interprete.resize_tensor_input(self.entrada['index'], X.shape)
+            self.interprete.allocate_tensors()
+            self.forma = X.shape
+        self.interprete.set_tensor(self.entrada['index'], X.astype(self.entrada['dtype']))
+        self.interprete.invoke()
+        return self.interprete.get_tensor(self.salida['index'])
+
+    # Devuelve el índice de la categoría predicha para cada texto
+    def clasifica(self, textos):
+        return np.argmax(self.predice(preparaEntradaModelo(textos, self.tokenizer, self.config)), axis=1)
+
+# Carga un modelo guardado con el ejecutor indicado ('keras' o 'tflite') y clasifica un lote del conjunto de
+# test. Devuelve la memoria residente máxima del proceso (ru_maxrss) antes de cargar el modelo y después del
+# lote, en MB. Se llama desde un proceso aparte por ejecutor para que una medida no incluya la de la otra.
+def memoriaEjecucionModelo(directorioModelo, ejecutor, cuantizacion, tamLote):
+    _, _, textos_test, _ = lecturaTextosClasificador('datos')
+    textos = textos_test[:tamLote]
+    memoriaBase = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    if ejecutor == 'tflite':
+        ClasificadorTFLite(directorioModelo, cuantizacion).clasifica(textos)
+    else:
+        model, tokenizer, config = cargaModeloClasificador(directorioModelo)
+        model.predict_on_batch(preparaEntradaModelo(textos, tokenizer, config))
+    return {
+        'memoria_base_mb': memoriaBase,
+        'memoria_pico_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    }
+
+# Lanza memoriaEjecucionModelo en un proceso nuevo y devuelve su resultado
+def __midePorProceso(directorioModelo, ejecutor, cuantizacion, tamLote):
+    with tempfile.NamedTemporaryFile(suffix='.json', delete=False) as f:
+        ficheroParcial = f.name
+    subprocess.run([sys.executable, os.path.abspath(__file__), '-memoriaWorker', directorioModelo, ejecutor,
+                    cuantizacion, str(tamLote), ficheroParcial], check=True)
+    with open(ficheroParcial, 'r') as f:
+        memoria = json.load(f)
+    os.remove(ficheroParcial)
+    return memoria
+
+# Exporta un modelo a TFLite y lo compara con el modelo Keras original sobre el conjunto de test:
+# precisión de ambos, tiempo de inferencia por lotes, tamaño de los ficheros de modelo y memoria residente
+# de un proceso que solo carga cada modelo y clasifica un lote. El informe se guarda como JSON en resultsDir.
+def evaluaExportacionTFLite(directorioModelo, cuantizacion, resultsDir, tamLote=256):
+    ficheroTFLite = exportaTFLite(directorioModelo, cuantizacion)
+    model, tokenizer, config = cargaModeloClasificador(directorioModelo)
+    clasificador = ClasificadorTFLite(directorioModelo, cuantizacion)
+    _, _, textos_test, y_test = lecturaTextosClasificador('datos')
+    X_test = preparaEntradaModelo(textos_test, tokenizer, config)
+
+    def mide(predice):
+        # La primera llamada con cada forma de lote traza la función de predicción en Keras y reserva los
+        # tensores en TFLite; se hace una sin medir con el lote completo y otra con el último lote si es más pequeño
+        predice(X_test[:tamLote])
+        if len(X_test) % tamLote:
+            predice(X_test[len(X_test) - len(X_test) % tamLote:])
+        y_pred = []
+        inicio = time.perf_counter()
+        for i in range(0, len(X_test), tamLote):
+            y_pred.append(np.argmax(predice(X_test[i:i + tamLote]), axis=1))
+        return time.perf_counter() - inicio, float(np.mean(np.concatenate(y_pred) == y_test))
+
+    tiempoKeras, precisionKeras = mide(lambda X: model.predict_on_batch(X))
+    tiempoTFLite, precisionTFLite = mide(clasificador.predice)
+    # El fichero .tflite incluye el grafo y las operaciones de TensorFlow además de los pesos, así que se
+    # compara con el fichero .keras y no con la memoria de los pesos en float32
+    tamanoKeras = os.path.getsize(directorioModelo + '/modelo.keras') / 2**20
+    tamanoTFLite = os.path.getsize(ficheroTFLite) / 2**20
+    # La memoria se mide en procesos nuevos: en este ya están cargados los dos modelos y el pico de uno
+    # ocultaría el del otro. La memoria base (intérprete, TensorFlow y datos de test) se resta del pico.
+    memoriaKeras = __midePorProceso(directorioModelo, 'keras', cuantizacion, tamLote)
+    memoriaTFLite = __midePorProceso(directorioModelo, 'tflite', cuantizacion, tamLote)
+    memoriaModeloKeras = memoriaKeras['memoria_pico_mb'] - memoriaKeras['memoria_base_mb']
+    memoriaModeloTFLite = memoriaTFLite['memoria_pico_mb'] - memoriaTFLite['memoria_base_mb']
+    informe = {
+        'modelo': config['modelo'],
+        'cuantizacion': cuantizacion,
+        'precision_keras': precisionKeras,
+        'precision_tflite': precisionTFLite,
+        'perdida_precision': precisionKeras - precisionTFLite,
+        'inferencia_keras_s': tiempoKeras,
+        'inferencia_tflite_s': tiempoTFLite,
+        'aceleracion': tiempoKeras / tiempoTFLite,
+        'tamano_keras_mb': tamanoKeras,
+        'tamano_tflite_mb': tamanoTFLite,
+        'reduccion_tamano_fichero': tamanoKeras / tamanoTFLite,
+        'memoria_pico_keras_mb': memoriaKeras['memoria_pico_mb'],
+        'memoria_pico_tflite_mb': memoriaTFLite['memoria_pico_mb'],
+        'memoria_modelo_keras_mb': memoriaModeloKeras,
+        'memoria_modelo_tflite_mb': memoriaModeloTFLite
+    }
+    os.makedirs(resultsDir, exist_ok=True)
+    with open(resultsDir + '/exportacion_tflite_' + config['modelo'] + '_' + cuantizacion + '.json', 'w') as f:
+        json.dump(informe, f, indent=2)
+    print("Precisión Keras %.2f%%, TFLite %s %.2f%%. Aceleración %.2fx, fichero %.1f MB -> %.1f MB, "
+          "memoria del modelo %.1f MB -> %.1f MB (pico del proceso %.0f MB -> %.0f MB)" % (
+        precisionKeras * 100, cuantizacion, precisionTFLite * 100, informe['aceleracion'], tamanoKeras, tamanoTFLite,
+        memoriaModeloKeras, memoriaModeloTFLite, memoriaKeras['memoria_pico_mb'], memoriaTFLite['memoria_pico_mb']))
+    return informe
 
 #Definición del modelo usado, embeddings, una red lstm, una densa para procesar el resultado del LSTM
 #y una final para clasificar en las categorias deseadas
@@ -149,6 +718,175 @@ def createModelTransformer(tamVoc,tamFrase,tamEmbd,num_categorias):
     model.compile(loss='CategoricalCrossentropy', optimizer=Adam(1e-4), metrics=['accuracy'])
     return model
 
+# Devuelve los textos (título y descripción sin limpiar) y las categorías de entrenamiento y test
+# para el modelo TF-IDF, que aplica su propio análisis en lugar del Tokenizer de Keras
+def lecturaTextosClasificador(dir):
+    dataset_entrenamiento = __leeDataFrameClasificador(dir + '/clasificacionZaguanEntrenamiento.csv')
+    dataset_test = __leeDataFrameClasificador(dir + '/clasificacionZaguanTest.csv')
+    return (dataset_entrenamiento['Text'].fillna('').values, dataset_entrenamiento['indice_categoria'].values - 1,
+            dataset_test['Text'].fillna('').values, dataset_test['indice_categoria'].values - 1)
+
+#Definición del modelo lineal sobre vectores dispersos TF-IDF de unigramas y bigramas, usando el mismo
+#análisis que los índices, y un SVM lineal que se entrena en segundos sin necesidad de epochs
+def createModelTFIDF():
+    return make_pipeline(TfidfVectorizer(analyzer=analizaTextoTFIDF, sublinear_tf=True, min_df=2), LinearSVC())
+
+# Entrena desde cero los cuatro tipos de modelo con los mismos datos y compara el tiempo de entrenamiento,
+# el tiempo de inferencia sobre el conjunto de test y la precisión obtenida
+def comparaModelos(dir, numCategorias, tamEmbd, numEpochs, batchSize, resultsDir):
+    X_entren, y_entren, X_test, y_test, tamVoc, _ = lecturaDatosEntrenamientoYTestClasificador(dir, numCategorias)
+    textos_entren, categorias_entren, textos_test, categorias_test = lecturaTextosClasificador(dir)
+    os.makedirs(resultsDir, exist_ok=True)
+    with open(resultsDir + '/comparacion_modelos.txt', 'w') as f:
+        f.write('modelo\tentrenamiento_s\tinferencia_s\tprecision\n')
+        for modelo in tiposModelo:
+            if modelo == 'TFIDF':
+                model = createModelTFIDF()
+                inicio = time.perf_counter()
+                model.fit(textos_entren, categorias_entren)
+                tiempoEntrenamiento = time.perf_counter() - inicio
+                inicio = time.perf_counter()
+                y_pred = model.predict(textos_test)
+                tiempoInferencia = time.perf_counter() - inicio
+                precision = np.mean(y_pred == categorias_test)
+            else:
+                entren, test = X_entren, X_test
+                if modelo == 'LSTM':
+                    model = createModelLSTM(tamVoc, len(X_entren[0]), tamEmbd, numCategorias)
+                elif modelo == 'Transformer':
+                    model = createModelTransformer(tamVoc, len(X_entren[0]), tamEmbd, numCategorias)
+                else:
+                    model = createModelDensa(numCategorias)
+                    rango = [np.min(X_entren), np.max(X_entren)]
+                    entren, test = NormalizeDataRango(X_entren, rango), NormalizeDataRango(X_test, rango)
+                inicio = time.perf_counter()
+                model.fit(entren, y_entren, epochs=numEpochs, batch_size=batchSize, verbose=0)
+                tiempoEntrenamiento = time.perf_counter() - inicio
+                inicio = time.perf_counter()
+                y_pred = np.argmax(model.predict(test, verbose=0), axis=1)
+                tiempoInferencia = time.perf_counter() - inicio
+                precision = np.mean(y_pred == np.argmax(y_test, axis=1))
+            print("%s: entrenamiento %.2f s, inferencia %.2f s, precisión %.2f%%" % (modelo, tiempoEntrenamiento, tiempoInferencia, precision * 100))
+            f.write('%s\t%.3f\t%.3f\t%.4f\n' % (modelo, tiempoEntrenamiento, tiempoInferencia, precision))
+
+# Calcula la matriz de confusión (filas: categoría real, columnas: categoría predicha) sin recorrer los ejemplos
+def matrizConfusion(y_real, y_pred, numCategorias):
+    conteos = np.bincount(np.asarray(y_real) * numCategorias + np.asarray(y_pred), minlength=numCategorias * numCategorias)
+    return conteos.reshape((numCategorias, numCategorias)).astype(float)
+
+# Tamaño en disco (MB) de todos los ficheros de un directorio
+def __tamanoDirectorioMB(directorio):
+    return sum(os.path.getsize(os.path.join(directorio, f)) for f in os.listdir(directorio)) / 2**20
+
+# Entrena un modelo para el benchmark y devuelve el modelo y el tiempo medio por epoch
+def __entrenaModeloBenchmark(modelo, entren, y_entren, tamLote, numEpochs, numCategorias, tamEmbd, tamVoc):
+    if modelo == 'TFIDF':
+        model = createModelTFIDF()
+        inicio = time.perf_counter()
+        model.fit(entren, y_entren)
+        return model, time.perf_counter() - inicio
+    if modelo == 'LSTM':
+        model = createModelLSTM(tamVoc, len(entren[0]), tamEmbd, numCategorias)
+    elif modelo == 'Transformer':
+        model = createModelTransformer(tamVoc, len(entren[0]), tamEmbd, numCategorias)
+    else:
+        model = createModelDensa(numCategorias)
+    tiempos = TiempoEpoch()
+    model.fit(entren, y_entren, epochs=numEpochs, batch_size=tamLote, verbose=0, callbacks=[tiempos])
+    # La primera epoch incluye la construcción del grafo, no se cuenta si hay más
+    return model, float(np.mean(tiempos.tiempos[1:] or tiempos.tiempos))
+
+# Mide el coste de un tipo de modelo para cada tamaño de lote: tiempo medio por epoch de entrenamiento,
+# documentos por segundo y latencia p99 por lote en inferencia y tamaño del modelo. El modelo TFIDF no usa
+# lotes al entrenar, así que se entrena una sola vez. La memoria pico es la del proceso completo y solo
+# crece, así que se da una vez para todo el proceso y no por tamaño de lote; por eso benchmarkClasificadores
+# lanza un proceso por modelo e hilos. Los hilos de TensorFlow tienen que haberse fijado antes de llamar a este método.
+def benchmarkModelo(dir, modelo, hilos, tamLotes, numEpochs, numCategorias, tamEmbd):
+    tamVoc, tokenizer = None, None
+    if modelo == 'TFIDF':
+        entren, y_entren, test, _ = lecturaTextosClasificador(dir)
+    else:
+        entren, y_entren, test, _, tamVoc, tokenizer = lecturaDatosEntrenamientoYTestClasificador(dir, numCategorias)
+        if modelo == 'Densa':
+            rango = [np.min(entren), np.max(entren)]
+            entren, test = NormalizeDataRango(entren, rango), NormalizeDataRango(test, rango)
+    if modelo == 'TFIDF':
+        model, tiempoEpoch = __entrenaModeloBenchmark(modelo, entren, y_entren, None, numEpochs, numCategorias, tamEmbd, tamVoc)
+
+    filas = []
+    for tamLote in tamLotes:
+        if modelo != 'TFIDF':
+            model, tiempoEpoch = __entrenaModeloBenchmark(modelo, entren, y_entren, tamLote, numEpochs, numCategorias, tamEmbd, tamVoc)
+        predice = model.predict if modelo == 'TFIDF' else model.predict_on_batch
+
+        # La primera llamada con cada forma de lote traza la función de predicción; se hace una sin medir
+        # con el lote completo y otra con el último lote si es más pequeño
+        predice(test[:tamLote])
+        if len(test) % tamLote:
+            predice(test[len(test) - len(test) % tamLote:])
+        latencias = []
+        for i in range(0, len(test), tamLote):
+            inicio = time.perf_counter()
+            predice(test[i:i + tamLote])
+            latencias.append(time.perf_counter() - inicio)
+
+        with tempfile.TemporaryDirectory() as directorio:
+            guardaModeloClasificador(directorio, modelo, model, tokenizer,
+                                     None if modelo == 'TFIDF' else len(entren[0]), None)
+            tamanoModelo = __tamanoDirectorioMB(directorio)
+
+        filas.append({
+            'modelo': modelo,
+            'hilos': hilos,
+            'tam_lote': tamLote,
+            'entrenamiento_s_por_epoch': tiempoEpoch,
+            'inferencia_docs_s': len(test) / sum(latencias),
+            'latencia_p99_ms': float(np.percentile(latencias, 99) * 1000),
+            'tamano_modelo_mb': tamanoModelo
+        })
+    return {
+        'modelo': modelo,
+        'hilos': hilos,
+        'memoria_pico_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        'lotes': filas
+    }
+
+# Ejecuta el benchmark de todos los tipos de modelo para cada combinación de hilos y tamaños de lote.
+# Cada modelo y número de hilos se mide en un proceso aparte, porque TensorFlow no permite cambiar los
+# hilos una vez inicializado y así la memoria pico de cada medida no incluye la de las anteriores.
+# Los resultados se escriben en benchmark.json (una entrada por proceso con su memoria pico y la lista de
+# medidas por tamaño de lote) y se resumen en la gráfica benchmark.png.
+def benchmarkClasificadores(resultsDir, tamLotes, listaHilos):
+    os.makedirs(resultsDir, exist_ok=True)
+    resultados = []
+    for modelo in tiposModelo:
+        for hilos in listaHilos:
+            with tempfile.NamedTemporaryFile(suffix='.json', delete=False) as f:
+                ficheroParcial = f.name
+            subprocess.run([sys.executable, os.path.abspath(__file__), '-benchmarkWorker', modelo, str(hilos), ficheroParcial,
+                            '-lotes', ','.join(str(t) for t in tamLotes)], check=True)
+            with open(ficheroParcial, 'r') as f:
+                resultados.append(json.load(f))
+            os.remove(ficheroParcial)
+
+    with open(resultsDir + '/benchmark.json', 'w') as f:
+        json.dump(resultados, f, indent=2)
+
+    fig, (ejeInferencia, ejeEntrenamiento) = plt.subplots(1, 2, figsize=(14, 5))
+    for proceso in resultados:
+        serie = proceso['lotes']
+        lotes = [r['tam_lote'] for r in serie]
+        etiqueta = '%s (%d hilos, %.0f MB)' % (proceso['modelo'], proceso['hilos'], proceso['memoria_pico_mb'])
+        ejeInferencia.plot(lotes, [r['inferencia_docs_s'] for r in serie], marker='o', label=etiqueta)
+        ejeEntrenamiento.plot(lotes, [r['entrenamiento_s_por_epoch'] for r in serie], marker='o', label=etiqueta)
+    for eje, etiquetaY in [(ejeInferencia, 'Documentos/s en inferencia'), (ejeEntrenamiento, 'Segundos por epoch')]:
+        eje.set_xscale('log', base=2)
+        eje.set_xlabel('Tamaño de lote', fontsize=12)
+        eje.set_ylabel(etiquetaY, fontsize=12)
+    ejeInferencia.legend(fontsize=8)
+    plt.savefig(resultsDir + '/benchmark.png')
+    plt.close()
+
 #---------------------------------------------------------------------------------------------------------------------------------------------------------
 string_categorias = ["Ciencias Sociales y Humanidades", "Ciencias de la Salud", "Ingenierías", "Ciencias y Tecnología",
                     "Arquitectura y Urbanismo", "Educación", "Ciencias Sociales y Gestión",
@@ -165,60 +903,202 @@ nombre_carreras_categorias = [['arte', 'clasicos', 'filosofia', 'historia', 'fil
                 ['bellas artes', 'comunicacion', 'informacion', 'documentacion', 'diseño', 'publicidad', 'audiovisual', 'periodismo', 'moda'],
                 ['lenguas', 'modernas', 'traduccion', 'interpretacion', 'turismo', 'hosteleria','cultural', 'extranjeras'],
                 ['otras']]
+patronCarreras, categoriaPorPalabra = __compilaPatronCarreras(nombre_carreras_categorias)
 #---------------------------------------------------------------------------------------------------------------------------------------------------------
 
 if __name__ == '__main__':
-    set_random_seed(0)
     zaguanDir = 'recordsdc'
     resultsDir = 'datos/resultados'
+    procesos = None
+    almacen = None
+    tamMuestraEtiquetado = 0
+    streaming = False
+    compararEpoch = False
+    compararModelos = False
+    benchmark = False
+    benchmarkWorker = None
+    memoriaWorker = None
+    tamLotes = [32, 64, 256, 1024]
+    listaHilos = sorted({1, os.cpu_count() or 1})
+    modelo = None
+    reentrenar = False
+    entradaClasificar = None
+    salidaClasificar = 'datos/clasificacion.txt'
+    exportarTFLite = False
+    cuantizacionTFLite = None
     for i in range(len(sys.argv)):
         if sys.argv[i] == '-dir':
             zaguanDir = sys.argv[i + 1]
         elif sys.argv[i] == '-output':
             resultsDir = sys.argv[i + 1]
+        elif sys.argv[i] == '-procesos':
+            procesos = int(sys.argv[i + 1])
+        elif sys.argv[i] == '-almacen':
+            almacen = sys.argv[i + 1]
+        elif sys.argv[i] == '-benchEtiquetado':
+            tamMuestraEtiquetado = int(sys.argv[i + 1])
+        elif sys.argv[i] == '-streaming':
+            streaming = True
+        elif sys.argv[i] == '-compararEpoch':
+            compararEpoch = True
+        elif sys.argv[i] == '-benchmark':
+            benchmark = True
+        elif sys.argv[i] == '-benchmarkWorker':
+            benchmarkWorker = sys.argv[i + 1:i + 4]
+        elif sys.argv[i] == '-memoriaWorker':
+            memoriaWorker = sys.argv[i + 1:i + 6]
+        elif sys.argv[i] == '-lotes':
+            tamLotes = [int(t) for t in sys.argv[i + 1].split(',')]
+        elif sys.argv[i] == '-hilos':
+            listaHilos = [int(h) for h in sys.argv[i + 1].split(',')]
+        elif sys.argv[i] == '-compararModelos':
+            compararModelos = True
+        elif sys.argv[i] == '-modelo':
+            modelo = sys.argv[i + 1]
+        elif sys.argv[i] == '-reentrenar':
+            reentrenar = True
+        elif sys.argv[i] == '-clasificar':
+            entradaClasificar = sys.argv[i + 1]
+        elif sys.argv[i] == '-salida':
+            salidaClasificar = sys.argv[i + 1]
+        elif sys.argv[i] == '-exportarTFLite':
+            exportarTFLite = True
+        elif sys.argv[i] == '-tflite':
+            cuantizacionTFLite = sys.argv[i + 1]
+
+    # Los hilos de TensorFlow solo se pueden fijar antes de que se inicialice, así que se hace lo primero
+    if benchmarkWorker is not None:
+        tf.config.threading.set_intra_op_parallelism_threads(int(benchmarkWorker[1]))
+        tf.config.threading.set_inter_op_parallelism_threads(int(benchmarkWorker[1]))
+    set_random_seed(0)
+
+    if tamMuestraEtiquetado > 0:
+        benchmarkEtiquetado(zaguanDir, tamMuestraEtiquetado, procesos)
+        sys.exit(0)
+
+    # Clasificación por lotes con un modelo ya entrenado, sin preguntar nada por consola
+    if entradaClasificar:
+        if modelo is None:
+            print("Error: para clasificar hay que indicar el modelo con -modelo (Transformer, LSTM, Densa o TFIDF).")
+            sys.exit(1)
+        if modelo == 'TFIDF' and cuantizacionTFLite is not None:
+            print("Error: el modelo TFIDF no tiene versión TFLite, se clasifica sin -tflite.")
+            sys.exit(1)
+        clasificaLote('datos/modelo_' + modelo, entradaClasificar, salidaClasificar, procesos=procesos, cuantizacion=cuantizacionTFLite)
+        sys.exit(0)
+
+    if memoriaWorker is not None:
+        directorioMemoria, ejecutorMemoria, cuantizacionMemoria, loteMemoria, ficheroMemoria = memoriaWorker
+        memoria = memoriaEjecucionModelo(directorioMemoria, ejecutorMemoria, cuantizacionMemoria, int(loteMemoria))
+        with open(ficheroMemoria, 'w') as f:
+            json.dump(memoria, f)
+        sys.exit(0)
+
+    # Exportación a TFLite de un modelo ya entrenado e informe de precisión, velocidad, tamaño y memoria
+    if exportarTFLite:
+        if modelo is None:
+            print("Error: para exportar hay que indicar el modelo con -modelo (Transformer, LSTM o Densa).")
+            sys.exit(1)
+        evaluaExportacionTFLite('datos/modelo_' + modelo, cuantizacionTFLite or 'int8', resultsDir)
+        sys.exit(0)
 
     if not os.path.isfile('datos/clasificacionZaguanTest.csv') or not os.path.isfile('datos/clasificacionZaguanEntrenamiento.csv'):
-        procesarXML(zaguanDir)
+        procesarXML(zaguanDir, procesos, almacen)
 
     numCategorias = len(string_categorias)
-    X_entren, y_entren, X_test, y_test, tamVoc = lecturaDatosEntrenamientoYTestClasificador("datos", numCategorias)
     tamEmbd = 50
     numEpochs = 10
     pasosValidacion = 10
     batchSize = 64
 
-    while True:
-        modelo = input("Introduce el tipo de modelo (Transformer, LSTM, Densa): ")
-        if modelo in ['Transformer', 'LSTM', 'Densa']:
+    if compararEpoch:
+        comparaTiempoEpoch('datos', numCategorias, tamEmbd, batchSize, resultsDir)
+        sys.exit(0)
+
+    if benchmarkWorker is not None:
+        modeloBench, hilosBench, ficheroBench = benchmarkWorker
+        with open(ficheroBench, 'w') as f:
+            json.dump(benchmarkModelo('datos', modeloBench, int(hilosBench), tamLotes, 2, numCategorias, tamEmbd), f)
+        sys.exit(0)
+
+    if benchmark:
+        benchmarkClasificadores(resultsDir, tamLotes, listaHilos)
+        sys.exit(0)
+
+    if compararModelos:
+        comparaModelos('datos', numCategorias, tamEmbd, numEpochs, batchSize, resultsDir)
+        sys.exit(0)
+
+    while modelo not in tiposModelo:
+        modelo = input("Introduce el tipo de modelo (Transformer, LSTM, Densa, TFIDF): ")
+        if modelo in tiposModelo:
             print(f"Has seleccionado el modelo: {modelo}")
-            break  # Salir del bucle si la entrada es válida
         else:
-            print("Modelo no válido. Por favor, elige entre 'Transformer', 'LSTM' o 'Densa'.")
+            print("Modelo no válido. Por favor, elige entre 'Transformer', 'LSTM', 'Densa' o 'TFIDF'.")
 
-    if modelo == 'LSTM':
-        model = createModelLSTM(tamVoc,len(X_entren[0]),  tamEmbd, numCategorias)
-    elif modelo == 'Transformer':
-        model = createModelTransformer(tamVoc,len(X_entren[0]),  tamEmbd, numCategorias)
-    else: 
-        model = createModelDensa(numCategorias)
-        X_entren = NormalizeData(X_entren)
-        X_test = NormalizeData(X_test)
-
-    if modelo == 'LSTM' and os.path.isfile('modelo_entrenado_clasificador_LSTM.h5'):
-        model = load_model('datos/modelo_entrenado_clasificador_LSTM.h5')
-    elif modelo == 'Densa' and os.path.isfile('modelo_entrenado_clasificador_densa.h5'):
-        model = load_model('datos/modelo_entrenado_clasificador_Denso.h5')
-    else: 
-        history = model.fit(X_entren, y_entren, epochs=numEpochs, validation_steps=pasosValidacion, batch_size=batchSize , verbose=0)
+    directorioModelo = 'datos/modelo_' + modelo
+
+    tiempos = TiempoEpoch()
+    history = None
+    claveCorpus = __claveCacheCorpus(['datos/clasificacionZaguanEntrenamiento.csv', 'datos/clasificacionZaguanTest.csv'])
+    cargarModelo = not reentrenar and existeModeloClasificador(directorioModelo, claveCorpus, streaming)
+    if modelo == 'TFIDF':
+        textos_entren, categorias_entren, textos_test, y_test = lecturaTextosClasificador('datos')
+        if cargarModelo:
+            model, _, _ = cargaModeloClasificador(directorioModelo)
+        else:
+            model = createModelTFIDF()
+            model.fit(textos_entren, categorias_entren)
+            guardaModeloClasificador(directorioModelo, modelo, model, None, None, claveCorpus, streaming=streaming)
+        y_pred = model.predict(textos_test)
+        scores = [None, np.mean(y_pred == y_test)]
+    elif streaming:
+        # El modelo denso trabaja sobre vectores de longitud fija, así que no admite buckets
+        if modelo == 'Densa':
+            print("El modelo Densa no admite el entrenamiento en streaming.")
+            sys.exit(1)
+        tfrecordEntrenamiento, tfrecordTest, tamVoc, tokenizer = preparaCorpusStreaming('datos')
+        dsEntren = creaDatasetStreaming(tfrecordEntrenamiento, numCategorias, batchSize)
+        dsTest = creaDatasetStreaming(tfrecordTest, numCategorias, batchSize, entrenamiento=False)
+        if cargarModelo:
+            model, _, _ = cargaModeloClasificador(directorioModelo)
+        else:
+            if modelo == 'LSTM':
+                model = createModelLSTM(tamVoc, None, tamEmbd, numCategorias)
+            else:
+                model = createModelTransformer(tamVoc, MAXLEN_SECUENCIA, tamEmbd, numCategorias)
+            history = model.fit(dsEntren, epochs=numEpochs, verbose=0, callbacks=[tiempos])
+            guardaModeloClasificador(directorioModelo, modelo, model, tokenizer, MAXLEN_SECUENCIA, claveCorpus, streaming=True)
+        scores = model.evaluate(dsTest, verbose=0)
+        y_pred, y_test = prediceDataset(model, dsTest)
+    else:
+        X_entren, y_entren, X_test, y_test, tamVoc, tokenizer = lecturaDatosEntrenamientoYTestClasificador("datos", numCategorias)
+        normalizacion = None
         if modelo == 'LSTM':
-            model.save('datos/modelo_entrenado_clasificador_LSTM.h5')
-        elif modelo == 'Densa':
-            model.save('datos/modelo_entrenado_clasificador_densa.h5')
+            model = createModelLSTM(tamVoc,len(X_entren[0]),  tamEmbd, numCategorias)
+        elif modelo == 'Transformer':
+            model = createModelTransformer(tamVoc,len(X_entren[0]),  tamEmbd, numCategorias)
+        else:
+            model = createModelDensa(numCategorias)
+            normalizacion = [int(np.min(X_entren)), int(np.max(X_entren))]
+
+        if cargarModelo:
+            model, _, config = cargaModeloClasificador(directorioModelo)
+            normalizacion = config['normalizacion']
+        # El test se normaliza con el rango de entrenamiento, el mismo que se guarda con el modelo
+        if normalizacion is not None:
+            X_entren = NormalizeDataRango(X_entren, normalizacion)
+            X_test = NormalizeDataRango(X_test, normalizacion)
+        if not cargarModelo:
+            history = model.fit(X_entren, y_entren, epochs=numEpochs, validation_steps=pasosValidacion, batch_size=batchSize , verbose=0, callbacks=[tiempos])
+            guardaModeloClasificador(directorioModelo, modelo, model, tokenizer, len(X_entren[0]), claveCorpus, normalizacion=normalizacion)
 
+        scores = model.evaluate(X_test, y_test, verbose=0)
+        # Obtenemos las categorías predichas para los datos de test
+        y_pred = np.argmax(model.predict(X_test), axis=1)
+        y_test = np.argmax(y_test, axis=1)
 
-            
     # Ejemplo de evaluación y clasificación
-    scores = model.evaluate(X_test, y_test, verbose=0)
     print("Precisión del modelo con los test: %.2f%%" % (scores[1] * 100))
     if not os.path.exists(resultsDir):
         os.makedirs(resultsDir)  # Crea el directorio si no existe
@@ -228,17 +1108,15 @@ if __name__ == '__main__':
         f.write(str(scores[1] * 100))
     f.close()
 
-    # visualizamos la evolución del error de entrenamiento
-    visualizaSerieDatos(history.history['accuracy'], 'Epoch', 'Precisión', resultsDir + '/precision.jpg')
-    visualizaSerieDatos(history.history['loss'], 'Epoch', 'Error', resultsDir + '/error.jpg')
+    # visualizamos la evolución del error de entrenamiento (solo si se ha entrenado en esta ejecución)
+    if history is not None:
+        visualizaSerieDatos(history.history['accuracy'], 'Epoch', 'Precisión', resultsDir + '/precision.jpg')
+        visualizaSerieDatos(history.history['loss'], 'Epoch', 'Error', resultsDir + '/error.jpg')
+        with open(resultsDir + '/tiempos_epoch.txt', 'w') as f:
+            f.write('\n'.join('%.3f' % t for t in tiempos.tiempos))
 
     # Obtenemos la matriz de confusion para los datos de test
-    y_pred = model.predict(X_test)
-    y_pred = np.argmax(y_pred, axis=1)
-    y_test = np.argmax(y_test, axis=1)
-    confusion = np.zeros((numCategorias, numCategorias))
-    for i in range(len(y_test)):
-        confusion[y_test[i]][y_pred[i]] += 1
+    confusion = matrizConfusion(y_test, y_pred, numCategorias)
     print('Matriz de confusión obtenida:')
     print(confusion)
     # Escribimos la matriz de confusion en un fichero
@@ -246,5 +1124,3 @@ if __name__ == '__main__':
     with open(resultsDir + '/confusion.txt', 'w') as f:
         f.write(str(confusion))
     f.close()
-
-
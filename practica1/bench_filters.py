@@ -0,0 +1,93 @@
+"""
+bench_filters.py
+Author: Sergio Salesa y Rubén Martín
+Last update: 2024-12-10
+
+Benchmark of the filter cache of MySearcher: runs the fielded queries of a query file (consultas.txt
+format) with and without the cache and reports the latency per query once the cache is warm.
+It also checks that both modes return the same ranked top-k (documents, order and scores) for every query.
+Usage: python bench_filters.py -index <index folder> -infoNeeds <query file> [-rounds 20] [-top 100]
+"""
+
+import sys
+import time
+
+# The schemas written by index.py pickle the analyzer as __main__.Stemming
+from search import MySearcher, Stemming
+
+
+def load_queries(query_file):
+    queries = []
+    with open(query_file, 'r') as f:
+        for line in f:
+            if line.strip():
+                tag, query = line.split(":", 1)
+                queries.append((tag, query))
+    return queries
+
+
+# Runs all the queries rounds times and returns the latency of each query execution in ms
+def time_queries(searcher, queries, rounds):
+    latencies = []
+    for _ in range(rounds):
+        for tag, query in queries:
+            started = time.perf_counter()
+            results = searcher.query(tag, query)
+            # Se leen los resultados para incluir la obtención de los documentos en la medida
+            [result.get('identity') for result in results]
+            latencies.append((time.perf_counter() - started) * 1000)
+    return latencies
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p * (len(values) - 1))))]
+
+
+if __name__ == '__main__':
+    index_folder = '../whooshindex'
+    query_file = 'consultas.txt'
+    rounds = 20
+    top_k = 100
+
+    i = 1
+    while i < len(sys.argv):
+        if sys.argv[i] == '-index':
+            index_folder = sys.argv[i + 1]
+            i += 1
+        elif sys.argv[i] == '-infoNeeds':
+            query_file = sys.argv[i + 1]
+            i += 1
+        elif sys.argv[i] == '-rounds':
+            rounds = int(sys.argv[i + 1])
+            i += 1
+        elif sys.argv[i] == '-top':
+            top_k = int(sys.argv[i + 1])
+            i += 1
+        i += 1
+
+    queries = load_queries(query_file)
+    searchers = {'no cache': MySearcher(index_folder, filter_cache=False),
+                 'filter cache': MySearcher(index_folder, filter_cache=True)}
+
+    # Both modes must return the same ranking: the same documents, in the same order, with the same score
+    mismatches = 0
+    for tag, query in queries:
+        ranked = [[(result.get('identity'), round(result.score, 6)) for result in searcher.query(tag, query, limit=top_k)]
+                  for searcher in searchers.values()]
+        if ranked[0] != ranked[1]:
+            mismatches += 1
+            print(f"Different top-{top_k} for {tag}:{query.strip()}")
+
+    print(f"{len(queries)} queries, {rounds} rounds, {mismatches} with a different top-{top_k}")
+    print(f"{'mode':<16}{'mean':>10}{'p50':>10}{'p95':>10}")
+    means = {}
+    for mode, searcher in searchers.items():
+        # Se calienta la caché (y la del sistema de ficheros) antes de medir
+        time_queries(searcher, queries, 1)
+        latencies = time_queries(searcher, queries, rounds)
+        means[mode] = sum(latencies) / len(latencies)
+        print(f"{mode:<16}{means[mode]:>10.3f}{percentile(latencies, 0.5):>10.3f}{percentile(latencies, 0.95):>10.3f}")
+    stats = searchers['filter cache'].filters.stats()
+    print(f"Speedup (mean): {means['no cache'] / means['filter cache']:.1f}x, cache hit rate {stats['hit_rate']:.1%}, "
+          f"{stats['memory_bytes']} bytes")
@@ -0,0 +1,129 @@
+"""
+bench_prefix.py
+Author: Sergio Salesa y Rubén Martín
+Last update: 2024-12-10
+
+Benchmark of prefix queries on person names ("Javi*") run through MySearcher.query: expansion of the
+prefix against the stemmed creator field versus a single term lookup on the edge n-gram creator_prefix
+field of MyIndex. It also counts the queries whose results include names that do not start with the
+prefix, which is what happens when the stemmer shortens the prefix before the expansion.
+A temporary index is built with synthetic names so the name vocabulary can be made as large as needed.
+Usage: python bench_prefix.py [-docs 50000] [-queries 500] [-index <index folder>]
+"""
+
+import sys
+import time
+import random
+import shutil
+import tempfile
+
+from whoosh.support.charset import accent_map
+from index import MyIndex, PREFIX_MIN, PREFIX_MAX
+from search import MySearcher
+
+SYLLABLES = ['ma', 'ri', 'jo', 'se', 'an', 'to', 'ni', 'lu', 'ca', 'ro', 'ber', 'nal', 'ga', 'gue', 'ras',
+             'fer', 'nan', 'dez', 'mar', 'tin', 'lo', 'pez', 'sa', 'les', 'ru', 'ben', 'ja', 'vi', 'er', 'nó']
+
+
+def random_word(rng):
+    return ''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))).capitalize()
+
+
+def random_name(rng):
+    return ' '.join(random_word(rng) for _ in range(3))
+
+
+# Builds an index with num_docs documents whose creator and contributor are synthetic names
+def build_index(index_folder, num_docs, rng):
+    my_index = MyIndex(index_folder, prefix_fields=True)
+    names = {}
+    for i in range(num_docs):
+        creator = random_name(rng)
+        names[f"doc{i}.xml"] = creator
+        my_index.add_document(path=f"doc{i}.xml", creator=creator, contributor=random_name(rng),
+                              publisher='', title='', description='', subject='', date='',
+                              modif='', identity=f"doc{i}")
+    my_index.writer.commit()
+    return names
+
+
+def percentiles(values):
+    values = sorted(values)
+    def pick(p):
+        return values[min(len(values) - 1, int(round(p * (len(values) - 1))))]
+    return {'p50': pick(0.50), 'p95': pick(0.95), 'max': values[-1], 'mean': sum(values) / len(values)}
+
+
+def fold(text):
+    return text.lower().translate(accent_map)
+
+
+# Runs every prefix as a creator query and returns the latency percentiles, the total number of hits
+# and the number of queries that returned some creator without a word starting with the prefix
+def time_queries(searcher, prefixes, names):
+    latencies = []
+    hits = 0
+    wrong = 0
+    for prefix in prefixes:
+        started = time.perf_counter()
+        results = searcher.query('creator', prefix + '*')
+        latencies.append((time.perf_counter() - started) * 1000)
+        hits += len(results)
+        creators = [searcher.searcher.stored_fields(hit.docnum)['path'] for hit in results]
+        if any(not any(word.startswith(fold(prefix)) for word in fold(names[path]).split()) for path in creators):
+            wrong += 1
+    return percentiles(latencies), hits, wrong
+
+
+if __name__ == '__main__':
+    num_docs = 50000
+    num_queries = 500
+    index_folder = None
+
+    i = 1
+    while i < len(sys.argv):
+        if sys.argv[i] == '-docs':
+            num_docs = int(sys.argv[i + 1])
+            i += 1
+        elif sys.argv[i] == '-queries':
+            num_queries = int(sys.argv[i + 1])
+            i += 1
+        elif sys.argv[i] == '-index':
+            index_folder = sys.argv[i + 1]
+            i += 1
+        i += 1
+
+    rng = random.Random(0)
+    temporary = index_folder is None
+    if temporary:
+        index_folder = tempfile.mkdtemp(prefix='bench_prefix_')
+    try:
+        started = time.perf_counter()
+        names = build_index(index_folder, num_docs, rng)
+        print(f"Index with {num_docs} documents built in {time.perf_counter() - started:.1f}s")
+
+        # Prefixes of 3 to 6 letters taken from random words of the indexed names, as the user would type them
+        prefixes = []
+        words = [word for name in names.values() for word in name.split()]
+        for _ in range(num_queries):
+            word = rng.choice(words)
+            prefixes.append(word[:rng.randint(3, min(6, len(word)))])
+        prefixes = [p for p in prefixes if PREFIX_MIN <= len(p) <= PREFIX_MAX]
+
+        # Se desactiva la caché de filtros para medir solo la resolución de los prefijos
+        results = {}
+        for method, prefix_queries in (('wildcard expansion', False), ('edge n-gram term', True)):
+            searcher = MySearcher(index_folder, filter_cache=False, prefix_queries=prefix_queries)
+            # Se calienta la caché del sistema de ficheros antes de medir
+            time_queries(searcher, prefixes[:20], names)
+            results[method] = time_queries(searcher, prefixes, names)
+        vocabulary = sum(1 for _ in searcher.searcher.reader().lexicon('creator'))
+        print(f"Name vocabulary: {vocabulary} distinct terms in creator, {len(prefixes)} prefix queries")
+
+        print(f"{'method':<22}{'p50':>10}{'p95':>10}{'max':>10}{'mean':>10}{'hits':>10}{'wrong':>10}")
+        for method, (stats, hits, wrong) in results.items():
+            print(f"{method:<22}" + ''.join(f"{stats[p]:>10.3f}" for p in ('p50', 'p95', 'max', 'mean')) + f"{hits:>10}{wrong:>10}")
+        print(f"Speedup (p50): {results['wildcard expansion'][0]['p50'] / results['edge n-gram term'][0]['p50']:.1f}x")
+    finally:
+        if temporary:
+            shutil.rmtree(index_folder)
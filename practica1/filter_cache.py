@@ -0,0 +1,356 @@
+"""
+filter_cache.py
+Author: Sergio Salesa y Rubén Martín
+Last update: 2024-12-10
+
+Cache of the docsets of frequent fielded terms (creator, contributor, date) stored as compressed
+bitmaps, so that boolean filters like "creator:Juan AND date:2007" are solved with bitmap operations
+before scoring instead of reading the posting lists again on every query.
+Each cached term also keeps its postings (docnums and weights), and the terms of the cached fields are
+replaced in the query by CachedTermQuery, which scores them with the searcher's weighting model exactly
+like a normal Term query but without reading the posting lists from disk.
+"""
+
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+from functools import reduce
+
+from whoosh.matching import ListMatcher, NullMatcher, WrappingMatcher
+from whoosh.query import Query, Term, And, Or, Not, AndNot
+from whoosh.reading import TermNotFound
+
+# Los contenedores con más de este número de documentos se guardan como bitmap (como en Roaring)
+ARRAY_LIMIT = 4096
+CHUNK_BITS = 1 << 16
+
+
+def _array_to_bits(container):
+    buffer = bytearray(CHUNK_BITS // 8)
+    for low in container:
+        buffer[low >> 3] |= 1 << (low & 7)
+    return int.from_bytes(buffer, 'little')
+
+
+def _bits_to_array(bits):
+    lows = array('H')
+    for i, byte in enumerate(bits.to_bytes(CHUNK_BITS // 8, 'little')):
+        if byte:
+            lows.extend(i * 8 + j for j in range(8) if byte >> j & 1)
+    return lows
+
+
+# Deja cada contenedor en su representación más compacta: array de 16 bits si tiene pocos documentos
+# o entero de 65536 bits si tiene muchos. Devuelve None si está vacío.
+def _normalize(container):
+    if isinstance(container, int):
+        count = container.bit_count()
+        if count == 0:
+            return None
+        return _bits_to_array(container) if count <= ARRAY_LIMIT else container
+    if len(container) == 0:
+        return None
+    return _array_to_bits(container) if len(container) > ARRAY_LIMIT else container
+
+
+def _and(a, b):
+    if isinstance(a, int) and isinstance(b, int):
+        return _normalize(a & b)
+    if isinstance(a, int):
+        a, b = b, a
+    if isinstance(b, int):
+        return _normalize(array('H', (low for low in a if b >> low & 1)))
+    return _normalize(array('H', sorted(set(a).intersection(b))))
+
+
+def _or(a, b):
+    if isinstance(a, int) or isinstance(b, int) or len(a) + len(b) > ARRAY_LIMIT:
+        bits_a = a if isinstance(a, int) else _array_to_bits(a)
+        bits_b = b if isinstance(b, int) else _array_to_bits(b)
+        return _normalize(bits_a | bits_b)
+    return _normalize(array('H', sorted(set(a).union(b))))
+
+
+def _andnot(a, b):
+    if isinstance(a, int):
+        return _normalize(a & ~(b if isinstance(b, int) else _array_to_bits(b)))
+    if isinstance(b, int):
+        return _normalize(array('H', (low for low in a if not b >> low & 1)))
+    return _normalize(array('H', sorted(set(a).difference(b))))
+
+
+# Conjunto de documentos comprimido al estilo Roaring: los ids se reparten en bloques de 2^16 según
+# sus 16 bits altos y cada bloque se guarda como array ordenado o como bitmap según su densidad.
+class RoaringBitmap:
+    def __init__(self, containers=None):
+        self.containers = containers or {}
+
+    @classmethod
+    def from_ids(cls, ids):
+        chunks = {}
+        for docnum in ids:
+            chunks.setdefault(docnum >> 16, array('H')).append(docnum & 0xFFFF)
+        containers = {}
+        for high, lows in chunks.items():
+            container = _normalize(array('H', sorted(set(lows))))
+            if container is not None:
+                containers[high] = container
+        return cls(containers)
+
+    def _combine(self, other, operation, keys):
+        containers = {}
+        for high in keys:
+            a, b = self.containers.get(high), other.containers.get(high)
+            if a is None:
+                container = b if operation is _or else None
+            elif b is None:
+                container = a
+            else:
+                container = operation(a, b)
+            if container is not None:
+                containers[high] = container
+        return RoaringBitmap(containers)
+
+    def __and__(self, other):
+        return self._combine(other, _and, self.containers.keys() & other.containers.keys())
+
+    def __or__(self, other):
+        return self._combine(other, _or, self.containers.keys() | other.containers.keys())
+
+    def __sub__(self, other):
+        return self._combine(other, _andnot, self.containers.keys())
+
+    def __len__(self):
+        return sum(c.bit_count() if isinstance(c, int) else len(c) for c in self.containers.values())
+
+    def __bool__(self):
+        return bool(self.containers)
+
+    def __contains__(self, docnum):
+        container = self.containers.get(docnum >> 16)
+        if container is None:
+            return False
+        low = docnum & 0xFFFF
+        if isinstance(container, int):
+            return bool(container >> low & 1)
+        i = bisect_left(container, low)
+        return i < len(container) and container[i] == low
+
+    def __iter__(self):
+        for high in sorted(self.containers):
+            container = self.containers[high]
+            lows = _bits_to_array(container) if isinstance(container, int) else container
+            base = high << 16
+            for low in lows:
+                yield base + low
+
+    # Memoria aproximada que ocupan los contenedores
+    def nbytes(self):
+        return sum(CHUNK_BITS // 8 if isinstance(c, int) else c.itemsize * len(c) for c in self.containers.values())
+
+
+# Posting list de un término guardada en la caché: el bitmap para las operaciones de filtro y los
+# docnums y pesos (frecuencias) para puntuar
+class CachedPostings:
+    def __init__(self, ids, weights, terminfo=None):
+        self.ids = ids
+        self.weights = weights
+        # Estadísticas del término (peso máximo, longitudes) que usan los scorers para acotar la puntuación
+        self.terminfo = terminfo
+        self.bitmap = RoaringBitmap.from_ids(ids)
+
+    def nbytes(self):
+        return self.bitmap.nbytes() + self.ids.itemsize * len(self.ids) + self.weights.itemsize * len(self.weights)
+
+
+# ListMatcher con salto por búsqueda binaria, para que las intersecciones no recorran la lista entera.
+# Trata la lista como un único bloque, así que su peso máximo es el del término en el segmento. Como la
+# posting list de whoosh, replace nunca se sustituye a sí mismo: WrappingMatcher le pasa la calidad mínima
+# sin dividir por el boost, e InverseMatcher acota su puntuación con la del hijo, así que descartar la
+# lista (o cambiarla por un NullMatcher) haría perder documentos del top-k.
+class CachedTermMatcher(ListMatcher):
+    def copy(self):
+        return self.__class__(self._ids, self._weights, scorer=self._scorer, position=self._i,
+                              term=self._term, terminfo=self._terminfo)
+
+    def replace(self, minquality=0):
+        return self
+
+    def skip_to(self, id):
+        if self.is_active() and id > self.id():
+            self._i = bisect_left(self._ids, id, self._i)
+
+    def skip_to_quality(self, minquality):
+        if self.block_quality() <= minquality:
+            self._i = len(self._ids)
+            return 1
+        return 0
+
+    def block_max_weight(self):
+        return self._terminfo.max_weight()
+
+
+# Sustituye a un Term de un campo cacheado. Puntúa con el scorer del modelo de pesos del searcher igual
+# que Term.matcher, pero con los docnums y pesos guardados en la caché en vez de leer la posting list.
+class CachedTermQuery(Query):
+    def __init__(self, cache, term):
+        self.cache = cache
+        self.term = term
+
+    def __repr__(self):
+        return "%s(%r)" % (self.__class__.__name__, self.term)
+
+    def __unicode__(self):
+        return str(self.term)
+
+    __str__ = __unicode__
+
+    def __eq__(self, other):
+        return other.__class__ is self.__class__ and other.term == self.term
+
+    def __hash__(self):
+        return hash(self.__class__.__name__) ^ hash(self.term)
+
+    def is_leaf(self):
+        return True
+
+    def terms(self, phrases=False):
+        return self.term.terms(phrases)
+
+    def estimate_size(self, ixreader):
+        return self.term.estimate_size(ixreader)
+
+    def matcher(self, searcher, context=None):
+        reader = searcher.reader()
+        postings = self.cache.term_postings(reader, segment_id(reader), self.term.fieldname, self.term.text)
+        if not postings.ids:
+            return NullMatcher()
+        # Igual que Searcher.postings: sin modelo de pesos en el contexto (p. ej. dentro de un NOT) se usa el del searcher
+        weighting = (context.weighting if context is not None else None) or searcher.weighting
+        scorer = weighting.scorer(searcher, self.term.fieldname, self.term.text)
+        m = CachedTermMatcher(postings.ids, weights=postings.weights, scorer=scorer,
+                              term=(self.term.fieldname, self.term.text), terminfo=postings.terminfo)
+        if self.term.boost != 1.0:
+            m = WrappingMatcher(m, boost=self.term.boost)
+        return m
+
+
+# Clave de caché de un segmento. Un commit que solo borra documentos mantiene el segmento pero cambia
+# sus documentos vivos, así que la clave incluye también el número de borrados.
+def segment_id(reader):
+    segment = reader.segment() if hasattr(reader, 'segment') else reader._segment
+    return segment.segment_id(), segment.deleted_count()
+
+
+# Caché LRU de posting lists y docsets por (segmento, campo, término). Como los docnums son locales a cada segmento,
+# al hacer commit basta con descartar las entradas de los segmentos que ya no existen o tienen otros borrados.
+class FilterCache:
+    def __init__(self, fields=('creator', 'contributor', 'date', 'creator_prefix', 'contributor_prefix'),
+                 max_bytes=64 * 1024 * 1024):
+        self.fields = set(fields)
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.memory = 0
+        self.hits = 0
+        self.misses = 0
+
+    def _get(self, key, build):
+        if key in self.entries:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return self.entries[key]
+        self.misses += 1
+        value = build()
+        self.entries[key] = value
+        self.memory += value.nbytes()
+        while self.memory > self.max_bytes and len(self.entries) > 1:
+            _, evicted = self.entries.popitem(last=False)
+            self.memory -= evicted.nbytes()
+        return value
+
+    def term_postings(self, reader, segment, fieldname, text):
+        def build():
+            ids, weights = array('I'), array('f')
+            try:
+                terminfo = reader.term_info(fieldname, text)
+                m = reader.postings(fieldname, text)
+                while m.is_active():
+                    ids.append(m.id())
+                    weights.append(m.weight())
+                    m.next()
+            except TermNotFound:
+                terminfo = None
+            return CachedPostings(ids, weights, terminfo)
+        return self._get((segment, fieldname, text), build)
+
+    def term_docs(self, reader, segment, fieldname, text):
+        return self.term_postings(reader, segment, fieldname, text).bitmap
+
+    # Todos los documentos vivos del segmento, para resolver los NOT
+    def all_docs(self, reader, segment):
+        return self._get((segment, None, None), lambda: RoaringBitmap.from_ids(reader.all_doc_ids()))
+
+    # Devuelve el bitmap de los documentos de un segmento que pueden cumplir la consulta o None si la
+    # consulta no se puede resolver solo con términos de los campos cacheados. Para un And basta con
+    # que alguna de sus partes sea resoluble, ya que el resultado final tiene que cumplirlas todas; pero
+    # lo que se niega (NOT) tiene que ser exacto, si no el complemento descartaría documentos válidos.
+    def docs_for_query(self, query, reader, segment, exact=False):
+        if isinstance(query, Term):
+            if query.fieldname in self.fields:
+                return self.term_docs(reader, segment, query.fieldname, query.text)
+            return None
+        if isinstance(query, AndNot):
+            positive = self.docs_for_query(query.a, reader, segment, exact)
+            negative = self.docs_for_query(query.b, reader, segment, True)
+            if positive is None or negative is None:
+                return None if exact else positive
+            return positive - negative
+        if isinstance(query, And):
+            parts = [self.docs_for_query(q, reader, segment, exact) for q in query.subqueries]
+            if exact and any(p is None for p in parts):
+                return None
+            parts = [p for p in parts if p is not None]
+            return reduce(lambda a, b: a & b, parts) if parts else None
+        if isinstance(query, Or):
+            parts = [self.docs_for_query(q, reader, segment, exact) for q in query.subqueries]
+            if not parts or any(p is None for p in parts):
+                return None
+            return reduce(lambda a, b: a | b, parts)
+        if isinstance(query, Not):
+            negative = self.docs_for_query(query.query, reader, segment, True)
+            if negative is None:
+                return None
+            return self.all_docs(reader, segment) - negative
+        return None
+
+    # Evalúa el filtro de la consulta con los bitmaps antes de puntuar. Devuelve False solo si en ningún
+    # segmento puede haber documentos que lo cumplan, y entonces no hace falta buscar.
+    def may_match(self, query, searcher):
+        for subsearcher, _ in searcher.leaf_searchers():
+            reader = subsearcher.reader()
+            bitmap = self.docs_for_query(query, reader, segment_id(reader))
+            if bitmap is None or bitmap:
+                return True
+        return False
+
+    # Sustituye los términos de los campos cacheados por CachedTermQuery. La estructura de la consulta y
+    # la puntuación de cada término no cambian, así que el ranking es el mismo que sin caché.
+    def rewrite(self, query):
+        if isinstance(query, Term) and query.fieldname in self.fields:
+            return CachedTermQuery(self, query)
+        return query.apply(self.rewrite)
+
+    # Descarta las entradas de los segmentos que ya no forman parte del índice o cuyos borrados han cambiado
+    def invalidate(self, live_segments):
+        for key in [key for key in self.entries if key[0] not in live_segments]:
+            self.memory -= self.entries.pop(key).nbytes()
+
+    def stats(self):
+        requests = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / requests if requests else 0.0,
+            'entries': len(self.entries),
+            'memory_bytes': self.memory
+        }
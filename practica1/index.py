@@ -5,19 +5,32 @@ Last update: 2024-09-25
 
 Simple program to create an inverted index with the contents of text/xml files contained in a docs folder
 This program is based on the whoosh library. See https://pypi.org/project/Whoosh/ .
-Usage: python index.py -index <index folder> -docs <docs folder>
+Usage: python index.py -index <index folder> -docs <docs folder> [-store <corpus store folder>]
+       [-limitmb <writer memory MB>] [-commitEvery <docs>] [-resume] [-prefixes]
 """
 
-from whoosh.index import create_in
+from whoosh.index import create_in, open_dir, exists_in
+from whoosh.query import TermRange
 from whoosh.fields import *
 from datetime import datetime
-from whoosh.analysis import RegexTokenizer, LowercaseFilter, StopFilter, Filter
+from whoosh.analysis import RegexTokenizer, LowercaseFilter, StopFilter, Filter, CharsetFilter, NgramFilter
+from whoosh.support.charset import accent_map
 from nltk.stem.snowball import SnowballStemmer
 
 import os
+import json
 
 import xml.etree.ElementTree as ET
 
+# Campos de personas que pueden tener un subcampo <campo>_prefix con los prefijos (edge n-grams) de cada
+# palabra sin stemming, para resolver consultas como "Javi*" con un único término
+PREFIX_FIELDS = ['creator', 'contributor']
+PREFIX_MIN = 2
+PREFIX_MAX = 15
+
+# Fichero dentro de la carpeta del índice con la ruta del último documento confirmado por un commit
+CHECKPOINT_FILE = 'checkpoint.json'
+
 def create_folder(folder_name):
     if (not os.path.exists(folder_name)):
         os.mkdir(folder_name)
@@ -37,7 +50,12 @@ class Stemming(Filter):
 class MyIndex:
     # Se ha creado el esquema (class Schema) que aplica un tokenizador, un filtro de conversión a minúsculas, 
     # un filtro de eliminación de palabras vacías. y un filtro que aplica un algoritmo de stemming.
-    def __init__(self,index_folder):
+    # Con prefix_fields se añaden los subcampos de prefijos de creator y contributor, que no aplican stemming
+    # ni stopwords pero sí eliminan los acentos, para que "Nogu*" encuentre "Nogueras" y "Noguéras".
+    # limitmb es la memoria del writer de whoosh antes de volcar a disco y commit_every el número de documentos
+    # entre commits intermedios; con resume se continúa una indexación interrumpida.
+    def __init__(self,index_folder, prefix_fields=False, limitmb=128, commit_every=None, resume=False):
+        self.prefix_fields = prefix_fields
         schema = Schema(
             path=ID(stored=True), 
             creator=TEXT(analyzer = RegexTokenizer(expression=r"\w+") | LowercaseFilter() | StopFilter() | Stemming()),
@@ -50,14 +68,45 @@ class MyIndex:
             modif=STORED,
             identity=STORED
         )
+        if prefix_fields:
+            for field in PREFIX_FIELDS:
+                schema.add(field + '_prefix', TEXT(analyzer = RegexTokenizer(expression=r"\w+") | LowercaseFilter() | CharsetFilter(accent_map) | NgramFilter(PREFIX_MIN, PREFIX_MAX, at='start'), phrase=False))
         create_folder(index_folder)
-        index = create_in(index_folder, schema)
-        self.writer = index.writer()
+        self.limitmb = limitmb
+        self.commit_every = commit_every
+        self.checkpoint_file = os.path.join(index_folder, CHECKPOINT_FILE)
+        self.last_path = None
+        self.indexed = 0
+        self.pending = 0
+        # Con resume se continúa un índice a medias desde su checkpoint; si no, se crea de cero
+        if resume and os.path.exists(self.checkpoint_file) and exists_in(index_folder):
+            with open(self.checkpoint_file, 'r') as f:
+                checkpoint = json.load(f)
+            self.last_path = checkpoint['last_path']
+            self.indexed = checkpoint['indexed_docs']
+            self.index = open_dir(index_folder)
+            # Los subcampos de prefijos dependen del esquema con el que se creó el índice
+            self.prefix_fields = all(field + '_prefix' in self.index.schema for field in PREFIX_FIELDS)
+            print(f"Reanudando la indexación tras {self.last_path} ({self.indexed} documentos ya indexados)")
+        else:
+            if os.path.exists(self.checkpoint_file):
+                os.remove(self.checkpoint_file)
+            self.index = create_in(index_folder, schema)
+        self.writer = self.index.writer(limitmb=limitmb)
+        # Si el proceso murió entre un commit y la escritura de su checkpoint, el índice ya contiene documentos
+        # posteriores a last_path; se borran para que al reanudar no queden duplicados
+        if self.last_path is not None:
+            self.writer.delete_by_query(TermRange('path', self.last_path, None, startexcl=True))
 
     
-    def index_docs(self,docs_folder):
-        if (os.path.exists(docs_folder)):
+    def index_docs(self,docs_folder, store_folder=None):
+        # Si hay un almacén columnar del corpus (almacenCorpus.py) se indexa desde él sin parsear los XML
+        if store_folder is not None:
+            self.index_store(store_folder)
+        elif (os.path.exists(docs_folder)):
             for file in sorted(os.listdir(docs_folder)):
+                if self.already_indexed(file):
+                    continue
                 # print(file)
                 # Si es un fichero .xml, se va a proceder a almacenar en tags los campos que queremos almacenar
                 if file.endswith('.xml'):
@@ -75,6 +124,62 @@ class MyIndex:
                 elif file.endswith('.txt'):
                     self.index_txt_doc(docs_folder, file)
         self.writer.commit()
+        # El índice está completo, así que el checkpoint ya no hace falta
+        if os.path.exists(self.checkpoint_file):
+            os.remove(self.checkpoint_file)
+
+    # Añade un documento al índice y, cada commit_every documentos, hace commit y guarda el checkpoint
+    def add_document(self, **fields):
+        # Los campos de personas se copian a sus subcampos de prefijos si los hay
+        if self.prefix_fields:
+            for field in PREFIX_FIELDS:
+                fields[field + '_prefix'] = fields.get(field, '')
+        self.writer.add_document(**fields)
+        self.pending += 1
+        if self.commit_every and self.pending >= self.commit_every:
+            self.commit_checkpoint(fields['path'])
+
+    # Confirma los documentos pendientes y guarda la ruta del último, de forma atómica para que un fallo
+    # a mitad de la escritura no deje un checkpoint corrupto. Se abre un writer nuevo para el siguiente tramo.
+    def commit_checkpoint(self, last_path):
+        self.writer.commit()
+        self.indexed += self.pending
+        self.pending = 0
+        self.last_path = last_path
+        temporary = self.checkpoint_file + '.tmp'
+        with open(temporary, 'w') as f:
+            json.dump({'last_path': last_path, 'indexed_docs': self.indexed}, f)
+        os.replace(temporary, self.checkpoint_file)
+        self.writer = self.index.writer(limitmb=self.limitmb)
+
+    # Al reanudar, los documentos hasta el checkpoint (en orden de ruta) ya están en el índice
+    def already_indexed(self, path):
+        return self.last_path is not None and path <= self.last_path
+
+    def index_store(self, store_folder):
+        sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+        from almacenCorpus import AlmacenCorpus
+        store = AlmacenCorpus(store_folder)
+        for i in range(len(store)):
+            if self.already_indexed(store.ruta(i)):
+                continue
+            record = store.registro(i)
+            # Se juntan los valores de cada campo igual que en index_xml_doc
+            raw_text = { field: ''.join(value.strip() + " " for value in record[field]) for field in
+                         ['creator', 'contributor', 'publisher', 'title', 'description', 'subject', 'date', 'identifier'] }
+            modified_date = datetime.fromtimestamp(record['mtime']).strftime('%a, %d %b %Y %H:%M:%S +0000')
+            self.add_document(
+                path=record['path'],
+                creator=raw_text['creator'],
+                contributor=raw_text['contributor'],
+                publisher=raw_text['publisher'],
+                title=raw_text['title'],
+                description=raw_text['description'],
+                subject=raw_text['subject'],
+                date=raw_text['date'],
+                modif=modified_date,
+                identity=raw_text['identifier']
+            )
 
     def index_txt_doc(self, foldername,filename):
         file_path = os.path.join(foldername, filename)
@@ -83,7 +188,7 @@ class MyIndex:
             text = ' '.join(line for line in fp if line)
             modified_date = datetime.fromtimestamp(os.path.getmtime(file_path)).strftime('%a, %d %b %Y %H:%M:%S +0000')
         # print(text)
-        self.writer.add_document(path=filename, content=text, modif=modified_date)
+        self.add_document(path=filename, content=text, modif=modified_date)
 
     def index_xml_doc(self, foldername, filename, tags):
         file_path = os.path.join(foldername, filename)
@@ -101,7 +206,7 @@ class MyIndex:
         modified_date = datetime.fromtimestamp(os.path.getmtime(file_path)).strftime('%a, %d %b %Y %H:%M:%S +0000')
         # print(text)
         # Hacemos un writer para cada uno de los campos
-        self.writer.add_document(
+        self.add_document(
             path=filename,
             creator=raw_text.get('dc:creator',''),
             contributor=raw_text.get('dc:contributor',''),
@@ -119,6 +224,11 @@ if __name__ == '__main__':
 
     index_folder = '../whooshindex'
     docs_folder = '../docs'
+    store_folder = None
+    prefix_fields = False
+    limitmb = 128
+    commit_every = None
+    resume = False
     i = 1
     while i < len(sys.argv):
         if sys.argv[i] == '-index':
@@ -127,9 +237,22 @@ if __name__ == '__main__':
         elif sys.argv[i] == '-docs':
             docs_folder = sys.argv[i + 1]
             i = i + 1
+        elif sys.argv[i] == '-store':
+            store_folder = sys.argv[i + 1]
+            i = i + 1
+        elif sys.argv[i] == '-limitmb':
+            limitmb = int(sys.argv[i + 1])
+            i = i + 1
+        elif sys.argv[i] == '-commitEvery':
+            commit_every = int(sys.argv[i + 1])
+            i = i + 1
+        elif sys.argv[i] == '-resume':
+            resume = True
+        elif sys.argv[i] == '-prefixes':
+            prefix_fields = True
         i = i + 1
 
-    my_index = MyIndex(index_folder)
-    my_index.index_docs(docs_folder)
+    my_index = MyIndex(index_folder, prefix_fields, limitmb, commit_every, resume)
+    my_index.index_docs(docs_folder, store_folder)
 
 
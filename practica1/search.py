@@ -17,6 +17,10 @@ from whoosh import scoring
 import whoosh.index as index
 from nltk.stem.snowball import SnowballStemmer
 from whoosh.analysis import Filter
+from whoosh.qparser import Plugin, PrefixPlugin, syntax
+from filter_cache import FilterCache, segment_id
+from index import PREFIX_FIELDS, PREFIX_MIN, PREFIX_MAX
+import re
 
 # Se ha creado la clase Stemming con la clase Filter, la cual aplicará el SnowballStemming en el analyzer
 class Stemming(Filter):
@@ -28,8 +32,39 @@ class Stemming(Filter):
             token.text = self.stemmer.stem(token.text)  
             yield token
 
+# Plugin del parser que convierte las consultas de prefijo ("Javi*") sobre un campo de personas en una
+# búsqueda de término en su subcampo de prefijos. Se aplica sobre el texto tal y como lo escribió el
+# usuario, antes de que el analizador del campo le aplique el stemming, y deja que el analizador del
+# subcampo (minúsculas y sin acentos) lo normalice. Así no se expande el prefijo contra todo el
+# diccionario de términos con stemming.
+class PrefixFieldPlugin(Plugin):
+    def __init__(self, fields):
+        self.fields = fields
+
+    # Prioridad 105: después de que FieldsPlugin asigne los campos (100)
+    def filters(self, parser):
+        return [(self.do_prefixes, 105)]
+
+    def do_prefixes(self, parser, group):
+        for i, node in enumerate(group):
+            if isinstance(node, syntax.GroupNode):
+                group[i] = self.do_prefixes(parser, node)
+            elif isinstance(node, PrefixPlugin.PrefixNode):
+                # WildcardPlugin ya ha convertido "Javi*" en un PrefixNode con el texto "Javi" sin analizar
+                fieldname = node.fieldname or parser.fieldname
+                if (fieldname in self.fields and re.fullmatch(r"\w+", node.text)
+                        and PREFIX_MIN <= len(node.text) <= PREFIX_MAX):
+                    word = syntax.WordNode(node.text)
+                    word.set_fieldname(fieldname + '_prefix')
+                    word.set_boost(node.boost)
+                    word.startchar, word.endchar = node.startchar, node.endchar
+                    group[i] = word
+        return group
+
+
 class MySearcher:
-    def __init__(self, index_folder, model_type = 'tfidf'):
+    # Con prefix_queries=False los prefijos se expanden siempre contra el campo con stemming (para comparar)
+    def __init__(self, index_folder, model_type = 'tfidf', filter_cache = True, prefix_queries = True):
         ix = index.open_dir(index_folder)
         if model_type == 'tfidf':
             # Apply a vector retrieval model as default
@@ -47,11 +82,36 @@ class MySearcher:
             'subject': QueryParser("subject", ix.schema, group = OrGroup),
             'date': QueryParser("date", ix.schema, group = OrGroup)
         }
+        # Campos de personas que tienen subcampo de prefijos en el índice (ver MyIndex en index.py)
+        prefix_fields = {field for field in PREFIX_FIELDS if field + '_prefix' in ix.schema}
+        if prefix_fields and prefix_queries:
+            for parser in self.parser.values():
+                parser.add_plugin(PrefixFieldPlugin(prefix_fields))
+        # Caché de docsets en bitmaps para los filtros por creator, contributor y date
+        self.filters = FilterCache() if filter_cache else None
 
-    def search(self, tag, query_text, query_number, results_file, info=False):
-        # Parse the query based on the tag (field)
+    # Si ha habido un commit desde que se abrió el searcher se reabre y se descartan de la caché
+    # de filtros los segmentos que ya no existen
+    def refresh(self):
+        if not self.searcher.up_to_date():
+            self.searcher = self.searcher.refresh()
+            if self.filters is not None:
+                self.filters.invalidate({segment_id(sub.reader()) for sub, _ in self.searcher.leaf_searchers()})
+
+    # Parse the query based on the tag (field) and return the whoosh results
+    # El filtro de los campos cacheados se evalúa antes con los bitmaps y, si ningún documento lo cumple,
+    # no se busca. Los términos de esos campos se puntúan con las posting lists guardadas en la caché.
+    def query(self, tag, query_text, limit=100):
         query = self.parser.get(tag, self.parser['title']).parse(query_text)
-        results = self.searcher.search(query, limit=100)  # Limit to top 100 results
+        self.refresh()
+        if self.filters is not None:
+            if not self.filters.may_match(query, self.searcher):
+                return []
+            query = self.filters.rewrite(query)
+        return self.searcher.search(query, limit=limit)
+
+    def search(self, tag, query_text, query_number, results_file, info=False):
+        results = self.query(tag, query_text)  # Limit to top 100 results
         #print(query)
         # Save the results to the output file
         # Creamos el fichero donde se guardarán los resultados de las consultas
@@ -105,3 +165,6 @@ if __name__ == '__main__':
             searcher.search(tag,query,query_number,results_file, info)
 
     print(f"Busqueda completada, los resultados están en {results_file}.")
+    if searcher.filters is not None:
+        stats = searcher.filters.stats()
+        print(f"Caché de filtros: {stats['hit_rate']:.1%} de aciertos, {stats['entries']} entradas, {stats['memory_bytes']} bytes.")
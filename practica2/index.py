@@ -5,10 +5,12 @@ Last update: 2024-09-07
 
 Simple program to create an inverted index with the contents of text/xml files contained in a docs folder
 This program is based on the whoosh library. See https://pypi.org/project/Whoosh/ .
-Usage: python index.py -index <index folder> -docs <docs folder>
+Usage: python index.py -index <index folder> -docs <docs folder> [-store <corpus store folder>]
+       [-limitmb <writer memory MB>] [-commitEvery <docs>] [-resume]
 """
 
-from whoosh.index import create_in
+from whoosh.index import create_in, open_dir, exists_in
+from whoosh.query import TermRange
 from whoosh.fields import *
 from datetime import datetime
 from whoosh.analysis import RegexTokenizer, LowercaseFilter, StopFilter, Filter
@@ -16,6 +18,7 @@ from nltk.stem.snowball import SnowballStemmer
 
 
 import os
+import json
 
 import xml.etree.ElementTree as ET
 
@@ -44,6 +47,9 @@ spanish_stopwords = [
 ]
 
 
+# Fichero dentro de la carpeta del índice con la ruta del último documento confirmado por un commit
+CHECKPOINT_FILE = 'checkpoint.json'
+
 def create_folder(folder_name):
     if (not os.path.exists(folder_name)):
         os.mkdir(folder_name)
@@ -60,8 +66,9 @@ class Stemming(Filter):
 
 
 class MyIndex:
-    def __init__(self,index_folder):
-        
+    # limitmb es la memoria del writer de whoosh antes de volcar a disco y commit_every el número de documentos
+    # entre commits intermedios; con resume se continúa una indexación interrumpida.
+    def __init__(self,index_folder, limitmb=128, commit_every=None, resume=False):
         schema = Schema(
             path=ID(stored=True), 
             creator=TEXT(analyzer = RegexTokenizer(expression=r"\w+") | LowercaseFilter() | StopFilter(spanish_stopwords) | Stemming()),
@@ -75,12 +82,38 @@ class MyIndex:
             identity=STORED
         )
         create_folder(index_folder)
-        index = create_in(index_folder, schema)
-        self.writer = index.writer()
+        self.limitmb = limitmb
+        self.commit_every = commit_every
+        self.checkpoint_file = os.path.join(index_folder, CHECKPOINT_FILE)
+        self.last_path = None
+        self.indexed = 0
+        self.pending = 0
+        # Con resume se continúa un índice a medias desde su checkpoint; si no, se crea de cero
+        if resume and os.path.exists(self.checkpoint_file) and exists_in(index_folder):
+            with open(self.checkpoint_file, 'r') as f:
+                checkpoint = json.load(f)
+            self.last_path = checkpoint['last_path']
+            self.indexed = checkpoint['indexed_docs']
+            self.index = open_dir(index_folder)
+            print(f"Reanudando la indexación tras {self.last_path} ({self.indexed} documentos ya indexados)")
+        else:
+            if os.path.exists(self.checkpoint_file):
+                os.remove(self.checkpoint_file)
+            self.index = create_in(index_folder, schema)
+        self.writer = self.index.writer(limitmb=limitmb)
+        # Si el proceso murió entre un commit y la escritura de su checkpoint, el índice ya contiene documentos
+        # posteriores a last_path; se borran para que al reanudar no queden duplicados
+        if self.last_path is not None:
+            self.writer.delete_by_query(TermRange('path', self.last_path, None, startexcl=True))
 
-    def index_docs(self,docs_folder):
-        if (os.path.exists(docs_folder)):
+    def index_docs(self,docs_folder, store_folder=None):
+        # Si hay un almacén columnar del corpus (almacenCorpus.py) se indexa desde él sin parsear los XML
+        if store_folder is not None:
+            self.index_store(store_folder)
+        elif (os.path.exists(docs_folder)):
             for file in sorted(os.listdir(docs_folder)):
+                if self.already_indexed(file):
+                    continue
                 # print(file)
                 if file.endswith('.xml'):
                     tags = {
@@ -97,6 +130,58 @@ class MyIndex:
                 elif file.endswith('.txt'):
                     self.index_txt_doc(docs_folder, file)
         self.writer.commit()
+        # El índice está completo, así que el checkpoint ya no hace falta
+        if os.path.exists(self.checkpoint_file):
+            os.remove(self.checkpoint_file)
+
+    # Añade un documento y, cada commit_every documentos, hace commit y guarda el checkpoint
+    def add_document(self, **fields):
+        self.writer.add_document(**fields)
+        self.pending += 1
+        if self.commit_every and self.pending >= self.commit_every:
+            self.commit_checkpoint(fields['path'])
+
+    # Confirma los documentos pendientes y guarda la ruta del último, de forma atómica para que un fallo
+    # a mitad de la escritura no deje un checkpoint corrupto. Se abre un writer nuevo para el siguiente tramo.
+    def commit_checkpoint(self, last_path):
+        self.writer.commit()
+        self.indexed += self.pending
+        self.pending = 0
+        self.last_path = last_path
+        temporary = self.checkpoint_file + '.tmp'
+        with open(temporary, 'w') as f:
+            json.dump({'last_path': last_path, 'indexed_docs': self.indexed}, f)
+        os.replace(temporary, self.checkpoint_file)
+        self.writer = self.index.writer(limitmb=self.limitmb)
+
+    # Al reanudar, los documentos hasta el checkpoint (en orden de ruta) ya están en el índice
+    def already_indexed(self, path):
+        return self.last_path is not None and path <= self.last_path
+
+    def index_store(self, store_folder):
+        sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+        from almacenCorpus import AlmacenCorpus
+        store = AlmacenCorpus(store_folder)
+        for i in range(len(store)):
+            if self.already_indexed(store.ruta(i)):
+                continue
+            record = store.registro(i)
+            # Se juntan los valores de cada campo igual que en index_xml_doc
+            raw_text = { field: ''.join(value.strip() + " " for value in record[field]) for field in
+                         ['creator', 'contributor', 'publisher', 'title', 'description', 'subject', 'date', 'identifier'] }
+            modified_date = datetime.fromtimestamp(record['mtime']).strftime('%a, %d %b %Y %H:%M:%S +0000')
+            self.add_document(
+                path=record['path'],
+                creator=raw_text['creator'],
+                contributor=raw_text['contributor'],
+                publisher=raw_text['publisher'],
+                title=raw_text['title'],
+                description=raw_text['description'],
+                subject=raw_text['subject'],
+                date=raw_text['date'],
+                modif=modified_date,
+                identity=raw_text['identifier']
+            )
 
     def index_txt_doc(self, foldername,filename):
         file_path = os.path.join(foldername, filename)
@@ -105,7 +190,7 @@ class MyIndex:
             text = ' '.join(line for line in fp if line)
             modified_date = datetime.fromtimestamp(os.path.getmtime(file_path)).strftime('%a, %d %b %Y %H:%M:%S +0000')
         # print(text)
-        self.writer.add_document(path=filename, content=text, modif=modified_date)
+        self.add_document(path=filename, content=text, modif=modified_date)
 
     def index_xml_doc(self, foldername, filename, tags):
         file_path = os.path.join(foldername, filename)
@@ -122,7 +207,7 @@ class MyIndex:
         #text = ' '.join(line.strip() for line in raw_text.splitlines() if line)
         modified_date = datetime.fromtimestamp(os.path.getmtime(file_path)).strftime('%a, %d %b %Y %H:%M:%S +0000')
         # print(text)
-        self.writer.add_document(
+        self.add_document(
             path=filename,
             creator=raw_text.get('dc:creator',''),
             contributor=raw_text.get('dc:contributor',''),
@@ -140,6 +225,10 @@ if __name__ == '__main__':
 
     index_folder = '../whooshindex'
     docs_folder = '../docs'
+    store_folder = None
+    limitmb = 128
+    commit_every = None
+    resume = False
     i = 1
     while i < len(sys.argv):
         if sys.argv[i] == '-index':
@@ -148,9 +237,20 @@ if __name__ == '__main__':
         elif sys.argv[i] == '-docs':
             docs_folder = sys.argv[i + 1]
             i = i + 1
+        elif sys.argv[i] == '-store':
+            store_folder = sys.argv[i + 1]
+            i = i + 1
+        elif sys.argv[i] == '-limitmb':
+            limitmb = int(sys.argv[i + 1])
+            i = i + 1
+        elif sys.argv[i] == '-commitEvery':
+            commit_every = int(sys.argv[i + 1])
+            i = i + 1
+        elif sys.argv[i] == '-resume':
+            resume = True
         i = i + 1
 
-    my_index = MyIndex(index_folder)
-    my_index.index_docs(docs_folder)
+    my_index = MyIndex(index_folder, limitmb, commit_every, resume)
+    my_index.index_docs(docs_folder, store_folder)
 
 
@@ -0,0 +1,275 @@
+"""
+replay.py
+Author: Sergio Salesa y Rubén Martín
+Last update: 2024-12-10
+
+Load generator that replays a query log against MySearcher and measures latency and throughput.
+Query logs can be in the fielded format of practica1 (consultas.txt, one "field:query" per line)
+or in the informationNeed XML format of practica2. The searcher is run in-process or behind a
+local socket server started with -serve.
+Usage: python replay.py -index <index folder> -queries <query log> [-qps 20] [-concurrency 4]
+                        [-requests 1000] [-warmup 50] [-target host:port] -report <report.json>
+       python replay.py -index <index folder> -serve <port> [-searcher practica1|practica2]
+       python replay.py -diff <base report.json> <new report.json> [-threshold 0.1]
+"""
+
+import sys
+import os
+import json
+import time
+import socket
+import threading
+import socketserver
+import importlib.util
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+from itertools import cycle, islice
+
+
+# Reads a query log and returns a list of queries {'tag': field or None, 'text': query text}.
+# XML files are read as practica2 information needs and any other file as practica1 fielded queries.
+def load_queries(query_file):
+    if query_file.endswith('.xml'):
+        root = ET.parse(query_file).getroot()
+        return [{'tag': None, 'text': need.findtext("text").strip()} for need in root.findall("informationNeed")]
+    queries = []
+    with open(query_file, 'r') as f:
+        for line in f:
+            if line.strip():
+                tag, query = line.split(":", 1)
+                queries.append({'tag': tag.strip(), 'text': query.strip()})
+    return queries
+
+
+# Loads the search.py module of practica1 or practica2 by path, since both are called search.py.
+def load_searcher_module(searcher):
+    folder = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', searcher)
+    path = os.path.join(folder, 'search.py')
+    # search.py may import other modules of its own folder
+    sys.path.insert(0, folder)
+    spec = importlib.util.spec_from_file_location(searcher + '_search', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    # The schemas written by index.py pickle its analyzer as __main__.Stemming, so the class has to be
+    # reachable from this __main__ for whoosh to open the index
+    setattr(sys.modules['__main__'], 'Stemming', module.Stemming)
+    return module
+
+
+# Whoosh searchers are not thread-safe, so every thread gets its own MySearcher on first use
+class LocalSearcher:
+    def __init__(self, index_folder, searcher):
+        self.index_folder = index_folder
+        self.searcher = searcher
+        self.module = load_searcher_module(searcher)
+        self.local = threading.local()
+
+    def run(self, query):
+        if not hasattr(self.local, 'searcher'):
+            self.local.searcher = self.module.MySearcher(self.index_folder)
+        if self.searcher == 'practica1':
+            results = self.local.searcher.query(query['tag'], query['text'])
+        else:
+            results = self.local.searcher.query(query['text'], verbose=False)
+        return [result.get('identity') for result in results]
+
+
+# Sends the queries to a server started with -serve. Each thread keeps its own connection open.
+class RemoteSearcher:
+    def __init__(self, target):
+        host, port = target.split(':')
+        self.address = (host, int(port))
+        self.local = threading.local()
+
+    def run(self, query):
+        if not hasattr(self.local, 'stream'):
+            self.local.stream = socket.create_connection(self.address).makefile('rw')
+        self.local.stream.write(json.dumps(query) + '\n')
+        self.local.stream.flush()
+        response = json.loads(self.local.stream.readline())
+        if 'error' in response:
+            raise RuntimeError(response['error'])
+        return response['ids']
+
+
+# Serves queries over a local socket, one JSON object per line in each direction
+def serve(index_folder, searcher, port):
+    local_searcher = LocalSearcher(index_folder, searcher)
+
+    class QueryHandler(socketserver.StreamRequestHandler):
+        def handle(self):
+            for line in self.rfile:
+                try:
+                    response = {'ids': local_searcher.run(json.loads(line))}
+                except Exception as e:
+                    response = {'error': str(e)}
+                self.wfile.write((json.dumps(response) + '\n').encode('utf-8'))
+
+    socketserver.ThreadingTCPServer.allow_reuse_address = True
+    with socketserver.ThreadingTCPServer(('127.0.0.1', port), QueryHandler) as server:
+        print(f"Serving {searcher} searcher on 127.0.0.1:{port}")
+        server.serve_forever()
+
+
+def percentiles(values):
+    values = sorted(values)
+    if not values:
+        return {'p50': 0.0, 'p95': 0.0, 'p99': 0.0, 'max': 0.0, 'mean': 0.0}
+    def pick(p):
+        return values[min(len(values) - 1, int(round(p * (len(values) - 1))))]
+    return {'p50': pick(0.50), 'p95': pick(0.95), 'p99': pick(0.99), 'max': values[-1],
+            'mean': sum(values) / len(values)}
+
+
+# Replays the queries cyclically until num_requests have been sent.
+# With qps > 0 the requests are sent on a fixed schedule (open loop) and the latency is measured from
+# the scheduled send time, so the time a request waits for a free worker is also counted.
+# With qps = 0 the workers send requests back to back (closed loop) and latency equals service time.
+# The first warmup requests are executed but not included in the statistics.
+def replay(search, queries, num_requests, qps, concurrency, warmup):
+    def execute(query, scheduled):
+        started = time.perf_counter()
+        try:
+            search.run(query)
+            error = None
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+        finished = time.perf_counter()
+        return (scheduled if scheduled is not None else started), started, finished, error
+
+    futures = []
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        start = time.perf_counter()
+        for i, query in enumerate(islice(cycle(queries), num_requests)):
+            scheduled = None
+            if qps > 0:
+                scheduled = start + i / qps
+                delay = scheduled - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            futures.append(executor.submit(execute, query, scheduled))
+    measured = [future.result() for future in futures[warmup:]]
+
+    latencies = [(finished - scheduled) * 1000 for scheduled, _, finished, _ in measured]
+    service = [(finished - started) * 1000 for _, started, finished, _ in measured]
+    errors = [error for _, _, _, error in measured if error is not None]
+    # The first distinct error messages are kept so the report shows why requests failed
+    error_samples = list(dict.fromkeys(errors))[:5]
+    elapsed = (max(m[2] for m in measured) - min(m[0] for m in measured)) if measured else 0.0
+    return {
+        'config': {'total_requests': num_requests, 'warmup': warmup, 'target_qps': qps,
+                   'concurrency': concurrency, 'distinct_queries': len(queries)},
+        'measured_requests': len(measured),
+        'errors': len(errors),
+        'error_rate': len(errors) / len(measured) if measured else 0.0,
+        'error_samples': error_samples,
+        'duration_s': elapsed,
+        'throughput_qps': len(measured) / elapsed if elapsed > 0 else 0.0,
+        'latency_ms': percentiles(latencies),
+        'service_ms': percentiles(service)
+    }
+
+
+# Compares two reports and prints the relative change of every metric. A regression is a latency
+# percentile or the error rate growing, or the throughput dropping, by more than threshold.
+# Returns True if a regression was found.
+def diff_reports(base_file, new_file, threshold):
+    with open(base_file, 'r') as f:
+        base = json.load(f)
+    with open(new_file, 'r') as f:
+        new = json.load(f)
+    metrics = [('latency_ms.' + p, base['latency_ms'][p], new['latency_ms'][p], 1) for p in ('p50', 'p95', 'p99', 'max')]
+    metrics.append(('throughput_qps', base['throughput_qps'], new['throughput_qps'], -1))
+    metrics.append(('error_rate', base['error_rate'], new['error_rate'], 1))
+    regression = False
+    print(f"{'metric':<18}{'base':>12}{'new':>12}{'change':>10}")
+    for name, old_value, new_value, direction in metrics:
+        change = (new_value - old_value) / old_value if old_value else (0.0 if new_value == old_value else float('inf'))
+        worse = change * direction > threshold
+        regression = regression or worse
+        print(f"{name:<18}{old_value:>12.3f}{new_value:>12.3f}{change:>+10.1%}{'  REGRESSION' if worse else ''}")
+    return regression
+
+
+if __name__ == '__main__':
+    # Default values
+    index_folder = '../whooshindex'
+    query_file = ''
+    report_file = ''
+    searcher = None
+    target = None
+    port = None
+    qps, concurrency, num_requests, warmup = 0.0, 1, None, 0
+    diff_files, threshold = None, 0.1
+
+    # Parse command-line arguments
+    i = 1
+    while i < len(sys.argv):
+        if sys.argv[i] == '-index':
+            index_folder = sys.argv[i + 1]
+            i += 1
+        elif sys.argv[i] == '-queries':
+            query_file = sys.argv[i + 1]
+            i += 1
+        elif sys.argv[i] == '-report':
+            report_file = sys.argv[i + 1]
+            i += 1
+        elif sys.argv[i] == '-searcher':
+            searcher = sys.argv[i + 1]
+            i += 1
+        elif sys.argv[i] == '-target':
+            target = sys.argv[i + 1]
+            i += 1
+        elif sys.argv[i] == '-serve':
+            port = int(sys.argv[i + 1])
+            i += 1
+        elif sys.argv[i] == '-qps':
+            qps = float(sys.argv[i + 1])
+            i += 1
+        elif sys.argv[i] == '-concurrency':
+            concurrency = int(sys.argv[i + 1])
+            i += 1
+        elif sys.argv[i] == '-requests':
+            num_requests = int(sys.argv[i + 1])
+            i += 1
+        elif sys.argv[i] == '-warmup':
+            warmup = int(sys.argv[i + 1])
+            i += 1
+        elif sys.argv[i] == '-diff':
+            diff_files = sys.argv[i + 1:i + 3]
+            i += 2
+        elif sys.argv[i] == '-threshold':
+            threshold = float(sys.argv[i + 1])
+            i += 1
+        i += 1
+
+    if diff_files:
+        sys.exit(1 if diff_reports(diff_files[0], diff_files[1], threshold) else 0)
+
+    if port is not None:
+        serve(index_folder, searcher or 'practica2', port)
+        sys.exit(0)
+
+    if not query_file:
+        print("Error: You must specify a query log using the -queries argument.")
+        sys.exit(1)
+
+    queries = load_queries(query_file)
+    if searcher is None:
+        searcher = 'practica2' if query_file.endswith('.xml') else 'practica1'
+    search = RemoteSearcher(target) if target else LocalSearcher(index_folder, searcher)
+    report = replay(search, queries, (num_requests or len(queries)) + warmup, qps, concurrency, warmup)
+    report['config'].update({'queries': query_file, 'searcher': searcher, 'target': target or 'in-process'})
+
+    print(f"Throughput: {report['throughput_qps']:.1f} qps, error rate: {report['error_rate']:.2%}")
+    print("Latency (ms): " + ", ".join(f"{p}={v:.2f}" for p, v in report['latency_ms'].items()))
+    for error in report['error_samples']:
+        print(f"Error: {error}")
+    if report_file:
+        with open(report_file, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Report written to {report_file}.")
+    # If every request failed the latencies are meaningless, so the run must not pass as a valid baseline
+    if report['measured_requests'] and report['errors'] == report['measured_requests']:
+        print("Error: all requests failed, the latency figures are not valid.")
+        sys.exit(1)
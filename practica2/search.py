@@ -43,7 +43,7 @@ class MySearcher:
             self.searcher = ix.searcher()
         self.parser = MultifieldParser( ["creator","contributor","publisher","title","description","subject","date"] ,ix.schema, group =OrGroup)
 
-    def process_query_with_ner(self, query_text):
+    def process_query_with_ner(self, query_text, verbose=True):
         # Process the query text with the NLP model (spaCy in this case)
         doc = nlp(query_text)
 
@@ -52,27 +52,33 @@ class MySearcher:
 
         # Iterate over the tokens in the processed doc
         for ent in doc.ents:
-            print(f"Entity: {ent.text}, Label: {ent.label_}")
+            if verbose:
+                print(f"Entity: {ent.text}, Label: {ent.label_}")
             # Add recognized named entities to the final query
             final_query.append(ent.text)
 
         # Join the entities to form the final query string
         final_query = query_text + ' '.join(final_query)
 
-        print("Final Query:")
-        print(final_query)
+        if verbose:
+            print("Final Query:")
+            print(final_query)
 
         return str(final_query)
 
+    # Refine the query with the named entities, parse it and return the whoosh results
+    def query(self, query_text, limit=100, verbose=True):
+        refined_query = self.process_query_with_ner(query_text, verbose)
+        query = self.parser.parse(refined_query)
+        if verbose:
+            print(query)
+        return self.searcher.search(query, limit=limit)
+
 
 
     
     def search(self, query_text, query_number, results_file, info=False):
-        # Parse the query based on the tag (field)
-        refined_query = self.process_query_with_ner(query_text)
-        query = self.parser.parse(refined_query)
-        print(query)
-        results = self.searcher.search(query, limit=100)  # Limit to top 100 results
+        results = self.query(query_text)  # Limit to top 100 results
         #print(query)
         # Save the results to the output file
         with open(results_file, 'a') as f:
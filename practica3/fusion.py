@@ -0,0 +1,135 @@
+"""
+fusion.py
+Author: Sergio Salesa y Rubén Martín
+Last update: 2024-12-10
+
+Program to fuse several result runs (for example the traditional run of practica2 and the
+semantic run of practica5) into a single run that can be evaluated with evaluation.py.
+Supported methods: reciprocal rank fusion (rrf), CombSUM (combsum) and CombMNZ (combmnz).
+Usage: python fusion.py -runs <run1> <run2> ... -output <fused run> [-method rrf] [-k 60] [-top 100]
+"""
+
+import sys
+import heapq
+from itertools import groupby
+
+
+# Separa los campos de las líneas no vacías de un fichero de resultados; cada línea debe traer al menos
+# la necesidad de información y el documento
+def split_lines(run_file, f):
+    for line_number, line in enumerate(f, start=1):
+        if not line.strip():
+            continue
+        fields = line.rstrip('\n').split('\t')
+        if len(fields) < 2:
+            raise ValueError(f"{run_file}:{line_number}: se esperaba 'necesidad<TAB>documento', "
+                             f"pero la línea tiene un solo campo: {line.strip()!r}")
+        yield fields
+
+
+# Lee un fichero de resultados en streaming y devuelve, para cada necesidad de información,
+# una lista con como mucho top elementos (documento, puntuación, posición).
+# Cada línea es "necesidad<TAB>documento" y opcionalmente "<TAB>puntuación". Si no hay puntuación
+# se usa la posición en el ranking. Las líneas de cada necesidad deben estar juntas y las necesidades
+# ordenadas (por ejemplo con "LC_ALL=C sort -s -k1,1"), para poder mezclar los ficheros sin cargarlos enteros.
+def read_run(run_file, top):
+    with open(run_file, 'r') as f:
+        last_need = None
+        for info_need, fields in groupby(split_lines(run_file, f), key=lambda fields: fields[0].strip()):
+            if last_need is not None and info_need <= last_need:
+                # La comparación es por código de carácter, así que sort debe usar la locale C
+                raise ValueError(f"{run_file}: la necesidad {info_need} no está ordenada, "
+                                 f"ordena el fichero con 'LC_ALL=C sort -s -k1,1' antes de fusionarlo")
+            last_need = info_need
+            docs = []
+            seen = set()
+            for rank, fields in enumerate(fields, start=1):
+                if len(docs) == top:
+                    continue
+                doc_id = fields[1].strip()
+                if doc_id in seen:
+                    continue
+                seen.add(doc_id)
+                score = float(fields[2]) if len(fields) > 2 and fields[2].strip() else None
+                docs.append((doc_id, score, rank))
+            yield info_need, docs
+
+
+# Normaliza las puntuaciones de un ranking al rango 0-1 (min-max). Si el ranking no trae puntuaciones
+# se usa como puntuación la posición invertida, de modo que el primer documento vale 1.
+def normalize_scores(docs):
+    if not docs:
+        return []
+    if all(score is not None for _, score, _ in docs):
+        scores = [score for _, score, _ in docs]
+    else:
+        scores = [-rank for _, _, rank in docs]
+    min_score, max_score = min(scores), max(scores)
+    if max_score == min_score:
+        return [(doc_id, 1.0) for doc_id, _, _ in docs]
+    return [(doc_id, (score - min_score) / (max_score - min_score)) for (doc_id, _, _), score in zip(docs, scores)]
+
+
+# Fusiona los rankings de una necesidad de información con el método indicado y devuelve los top mejores
+def fuse_need(rankings, method, k, top):
+    fused = {}
+    hits = {}
+    for docs in rankings:
+        if method == 'rrf':
+            scored = [(doc_id, 1.0 / (k + rank)) for doc_id, _, rank in docs]
+        else:
+            scored = normalize_scores(docs)
+        for doc_id, score in scored:
+            fused[doc_id] = fused.get(doc_id, 0.0) + score
+            hits[doc_id] = hits.get(doc_id, 0) + 1
+    if method == 'combmnz':
+        fused = {doc_id: score * hits[doc_id] for doc_id, score in fused.items()}
+    return heapq.nlargest(top, fused.items(), key=lambda item: item[1])
+
+
+# Mezcla los ficheros de resultados necesidad a necesidad con un merge de k vías sobre los flujos
+# ordenados. En memoria solo se guardan los top documentos de cada run para la necesidad actual.
+def fuse_runs(run_files, output_file, method='rrf', k=60, top=100):
+    streams = [((info_need, run, docs) for info_need, docs in read_run(run_file, top))
+               for run, run_file in enumerate(run_files)]
+    merged = heapq.merge(*streams, key=lambda item: (item[0], item[1]))
+    num_needs = 0
+    with open(output_file, 'w') as f:
+        for info_need, group in groupby(merged, key=lambda item: item[0]):
+            fused = fuse_need((docs for _, _, docs in group), method, k, top)
+            f.writelines(f"{info_need}\t{doc_id}\n" for doc_id, _ in fused)
+            num_needs += 1
+    print(f"{num_needs} necesidades fusionadas con {method}. Resultados escritos en {output_file}.")
+
+
+if __name__ == '__main__':
+    run_files, output_file = [], None
+    method, k, top = 'rrf', 60, 100
+    i = 1
+    while i < len(sys.argv):
+        if sys.argv[i] == '-runs':
+            while i + 1 < len(sys.argv) and not sys.argv[i + 1].startswith('-'):
+                run_files.append(sys.argv[i + 1])
+                i += 1
+        elif sys.argv[i] == '-output':
+            output_file = sys.argv[i + 1]
+            i += 1
+        elif sys.argv[i] == '-method':
+            method = sys.argv[i + 1]
+            i += 1
+        elif sys.argv[i] == '-k':
+            k = int(sys.argv[i + 1])
+            i += 1
+        elif sys.argv[i] == '-top':
+            top = int(sys.argv[i + 1])
+            i += 1
+        i += 1
+
+    if not run_files or not output_file:
+        print("Error: You must specify the runs with -runs and the output file with -output.")
+        sys.exit(1)
+    if method not in ('rrf', 'combsum', 'combmnz'):
+        print("Error: the method must be rrf, combsum or combmnz.")
+        sys.exit(1)
+
+    fuse_runs(run_files, output_file, method, k, top)